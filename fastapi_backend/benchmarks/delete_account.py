@@ -0,0 +1,115 @@
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, select, func
+
+# Loading environment variables before local imports, as the database URL is read on import:
+load_dotenv()
+
+from ..database import engine, SessionLocal, AsyncSessionLocal, async_engine
+from ..models import Base, User, Message, MessageInsight, UserInsight
+from ..enums import MessageType, DescriptionCategory
+from ..dependencies import get_user
+from ..services import user_service
+from ..services.blob_store import blob_store
+
+# Measures deleting an account with a long message history, with the batched set-based deletes
+# or (with --legacy) the previous approach of loading every message and deleting it through the ORM.
+# This creates and deletes a benchmark user, so it should be run against a disposable database.
+# Usage: python -m fastapi_backend.benchmarks.delete_account [--messages 100000] [--legacy]
+
+SEED_BATCH_SIZE = 10000
+
+
+def seed_account(message_count: int) -> int:
+    with SessionLocal() as db:
+        user = User(name="Benchmark", email=f"benchmark-{time.time_ns()}@example.com", password="-")
+        db.add(user)
+        db.flush()
+        db.add_all(UserInsight(user_id=user.id, category=category, score=0.1) for category in DescriptionCategory)
+        db.commit()
+        user_id = user.id
+
+    with engine.begin() as conn:
+        for start in range(0, message_count, SEED_BATCH_SIZE):
+            count = min(SEED_BATCH_SIZE, message_count - start)
+
+            # Every message has an insight, and one in a hundred has audio:
+            rows = [{
+                "user_id": user_id,
+                "type": MessageType.USER if (start + i) % 2 == 0 else MessageType.ASSISTANT,
+                "text": f"Benchmark message {start + i} " + "lorem ipsum " * 10,
+                "audio_ref": blob_store.put(b"\0" * 1024, "mp3", prefix="audio") if (start + i) % 100 == 0 else None,
+            } for i in range(count)]
+            message_ids = conn.scalars(insert(Message).returning(Message.id), rows).all()
+
+            conn.execute(insert(MessageInsight), [
+                {"message_id": message_id, "category": DescriptionCategory.SCENE, "score": 0.5} for message_id in message_ids
+            ])
+
+    return user_id
+
+
+def legacy_delete_account(user_id: int) -> None:
+    # The previous implementation - every message is loaded and deleted individually, followed by the user:
+    with SessionLocal() as db:
+        user = db.get(User, user_id)
+        messages = db.query(Message).filter(Message.user_id == user_id).all()
+        audio_refs = [message.audio_ref for message in messages if message.audio_ref]
+        for message in messages: db.delete(message)
+        db.delete(user)
+        db.commit()
+
+    blob_store.delete_many(audio_refs)
+
+
+async def delete_account(user_id: int) -> None:
+    async with AsyncSessionLocal() as db:
+        user = await get_user(db, user_id)
+        await user_service.delete_user(db, user)
+    await async_engine.dispose()
+
+
+def count_remaining(user_id: int) -> dict:
+    with SessionLocal() as db:
+        return {
+            "messages": db.scalar(select(func.count()).select_from(Message).filter(Message.user_id == user_id)),
+            "user_insights": db.scalar(select(func.count()).select_from(UserInsight).filter(UserInsight.user_id == user_id)),
+            "orphaned_message_insights": db.scalar(
+                select(func.count()).select_from(MessageInsight).outerjoin(Message).filter(Message.id.is_(None))
+            ),
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--legacy", action="store_true", help="Delete the account the way it was deleted before.")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    start = time.perf_counter()
+    user_id = seed_account(args.messages)
+    print(f"\033[1;34mSeeded {args.messages} messages in {time.perf_counter() - start:.1f}s.\033[0m")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    if args.legacy: legacy_delete_account(user_id)
+    else: asyncio.run(delete_account(user_id))
+
+    elapsed = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"\033[1;32m{'Legacy' if args.legacy else 'Batched'} delete of {args.messages} messages: "
+          f"{elapsed:.2f}s, peak Python memory {peak_memory / 1024 / 1024:.1f} MB.\033[0m")
+    print(f"Remaining rows: {count_remaining(user_id)}")
+
+
+if __name__ == "__main__":
+    main()
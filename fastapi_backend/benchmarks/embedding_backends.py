@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+
+from dotenv import load_dotenv
+
+# Loading environment variables before local imports, as the model settings are read on import:
+load_dotenv()
+
+from ..services.ml_services.embedding_backends import BACKENDS
+
+# Compares the embedding backends of the keyword extractor - the memory and time taken to load each,
+# the latency of scoring a single message and of scoring in batches, and how far each backend's category scores
+# are from those of the sentence-transformers reference.
+# Each backend is measured in its own process, so that their memory use doesn't overlap.
+# The ONNX model needs to be exported first, with: python -m fastapi_backend.services.ml_services.export_onnx
+# The measurements can be saved with --output, and the script exits with an error if a backend is outside the tolerance,
+# so it can be run as a check before switching EMBEDDING_BACKEND.
+# Usage: python -m fastapi_backend.benchmarks.embedding_backends [--backends sentence-transformers onnx] [--repeats 50] [--output FILE]
+
+REFERENCE_BACKEND = "sentence-transformers"
+
+# The ONNX backend is considered a drop-in replacement if every score is within this of the reference,
+# and it picks the same top category for nearly every message. These are the requirements for switching to it,
+# not measured values - no run against the real model has been recorded yet:
+SCORE_TOLERANCE = 0.05
+TOP_CATEGORY_AGREEMENT = 0.95
+
+
+def measure(backend_name: str, repeats: int) -> dict:
+    # Runs in a child process - importing the backend (e.g. torch) is part of the memory it uses:
+    start = time.perf_counter()
+    from ..services.ml_services.embedding_backends import get_embedding_backend
+    from ..services.ml_services.keyword_extraction import KeywordExtractor, TEST_CASES
+
+    extractor = KeywordExtractor(get_embedding_backend(backend_name))
+    load_seconds = time.perf_counter() - start
+    texts = [text for text, _ in TEST_CASES]
+
+    # Scoring one message at a time, as when each new message is scored:
+    latencies = []
+    for index in range(repeats):
+        start = time.perf_counter()
+        extractor.score_categories(texts[index % len(texts)])
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    scores = extractor.score_matrix(texts)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "load_seconds": load_seconds,
+        # ru_maxrss is in kilobytes on Linux:
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "single_p50_ms": statistics.median(latencies) * 1000,
+        "batch_texts_per_second": len(texts) / batch_seconds,
+        "scores": scores.tolist(),
+    }
+
+
+def run_child(backend_name: str, repeats: int) -> dict:
+    # Turning off the cache of input embeddings, so that every message is encoded:
+    output = subprocess.run(
+        [sys.executable, "-m", __spec__.name, "--child", backend_name, "--repeats", str(repeats)],
+        check=True, capture_output=True, text=True, env={**os.environ, "INPUT_EMBEDDING_CACHE_SIZE": "0"},
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(scores, reference_scores) -> tuple:
+    max_difference = max(abs(score - reference) for row, reference_row in zip(scores, reference_scores)
+                         for score, reference in zip(row, reference_row))
+    same_top = sum(row.index(max(row)) == reference_row.index(max(reference_row))
+                   for row, reference_row in zip(scores, reference_scores))
+    return max_difference, same_top / len(scores)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--output", help="Save the measurements (and the comparison with the reference) to this JSON file.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.repeats)))
+        return
+
+    results = {name: run_child(name, args.repeats) for name in args.backends}
+
+    for name, result in results.items():
+        print(f"\033[1;34m{name}: loaded in {result['load_seconds']:.1f}s, peak memory {result['peak_rss_mb']:.0f} MB, "
+              f"single message p50 {result['single_p50_ms']:.1f} ms, "
+              f"batches {result['batch_texts_per_second']:.0f} messages/s.\033[0m")
+
+    failed = []
+    for name, result in results.items():
+        if REFERENCE_BACKEND not in results or name == REFERENCE_BACKEND: continue
+
+        max_difference, agreement = compare(result["scores"], results[REFERENCE_BACKEND]["scores"])
+        passed = max_difference <= SCORE_TOLERANCE and agreement >= TOP_CATEGORY_AGREEMENT
+        result.update(max_score_difference=max_difference, top_category_agreement=agreement, within_tolerance=passed)
+        if not passed: failed.append(name)
+
+        print(f"\033[1;{'32' if passed else '31'}m{name} vs {REFERENCE_BACKEND}: largest score difference {max_difference:.4f} "
+              f"(tolerance {SCORE_TOLERANCE}), same top category for {agreement:.0%} of messages "
+              f"(required {TOP_CATEGORY_AGREEMENT:.0%}) - {'within' if passed else 'outside'} tolerance.\033[0m")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"score_tolerance": SCORE_TOLERANCE, "top_category_agreement": TOP_CATEGORY_AGREEMENT, "repeats": args.repeats,
+                       "backends": {name: {key: value for key, value in result.items() if key != "scores"}
+                                    for name, result in results.items()}}, f, indent=2)
+
+    if failed: sys.exit(f"Outside tolerance: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import time
+import asyncio
+import argparse
+import statistics
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, select, func
+
+# Loading environment variables before local imports, as the database URL and model settings are read on import:
+load_dotenv()
+
+from ..database import engine, SessionLocal, async_engine
+from ..models import Base, User, Message, MessageInsight
+from ..enums import MessageType
+from ..services.message_writer import message_writer
+from ..services.insight_scorer import InsightScorer, INSIGHT_SCORE_INTERVAL, INSIGHT_SCORE_BATCH_SIZE, INSIGHT_SCORE_QUEUE_SIZE
+from ..services.ml_services.keyword_extraction import KeywordExtractor, TEST_CASES
+
+# Measures the background insight scoring - how many messages per second it scores and stores when catching up,
+# compared with (--legacy) scoring each message and adding its insights one by one, as add_message used to,
+# and the latency of adding messages with scoring off and on, which should be the same.
+# This creates a benchmark user and messages, so it should be run against a disposable database.
+# Usage: python -m fastapi_backend.benchmarks.insight_scoring [--messages 2000] [--legacy 200] [--writes 500]
+
+SEED_BATCH_SIZE = 10000
+
+# How many messages are being added at once while the latency is measured:
+WRITE_CONCURRENCY = 10
+
+
+def seed_messages(message_count: int) -> int:
+    with SessionLocal() as db:
+        user = User(name="Benchmark", email=f"benchmark-{time.time_ns()}@example.com", password="-")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+    # Messages without insights, as if they were added while scoring was off:
+    texts = [text for text, _ in TEST_CASES]
+    with engine.begin() as conn:
+        for start in range(0, message_count, SEED_BATCH_SIZE):
+            conn.execute(insert(Message), [{
+                "user_id": user_id,
+                "type": MessageType.USER if index % 2 == 0 else MessageType.ASSISTANT,
+                "text": f"{texts[index % len(texts)]} ({index})",
+            } for index in range(start, min(start + SEED_BATCH_SIZE, message_count))])
+
+    return user_id
+
+
+def legacy_score(user_id: int, count: int) -> float:
+    # The previous approach - each message is scored on its own, and its insights are added and committed one by one:
+    extractor = KeywordExtractor()
+    start = time.perf_counter()
+
+    with SessionLocal() as db:
+        messages = db.scalars(select(Message).filter_by(user_id=user_id).order_by(Message.id).limit(count)).all()
+        for message in messages:
+            for category, score in extractor.score_categories(message.text).items():
+                db.add(MessageInsight(message_id=message.id, category=category, score=score))
+            db.commit()
+
+    return len(messages) / (time.perf_counter() - start)
+
+
+async def time_writes(user, count: int, scorer=None) -> list:
+    # Adding messages the way add_message does, timing each until it returns:
+    latencies, semaphore = [], asyncio.Semaphore(WRITE_CONCURRENCY)
+    texts = [text for text, _ in TEST_CASES]
+
+    async def write(index: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            message = await message_writer.write(user.id, user.name, MessageType.USER, f"{texts[index % len(texts)]} [{index}]")
+            if scorer is not None: scorer.submit(message)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(write(index) for index in range(count)))
+    return latencies
+
+
+def describe(latencies: list) -> str:
+    quantiles = statistics.quantiles(latencies, n=100)
+    return f"p50 {quantiles[49] * 1000:.1f} ms, p95 {quantiles[94] * 1000:.1f} ms"
+
+
+async def run(user_id: int, write_count: int) -> None:
+    scorer = InsightScorer(INSIGHT_SCORE_INTERVAL, INSIGHT_SCORE_BATCH_SIZE, INSIGHT_SCORE_QUEUE_SIZE)
+
+    start = time.perf_counter()
+    scored = await scorer.catch_up()
+    elapsed = time.perf_counter() - start
+    print(f"\033[1;32mBatched: scored {scored} messages in {elapsed:.2f}s ({scored / elapsed:.0f} messages/s, "
+          f"batches of {INSIGHT_SCORE_BATCH_SIZE}).\033[0m")
+
+    user = SimpleNamespace(id=user_id, name="Benchmark")
+    await time_writes(user, WRITE_CONCURRENCY)
+
+    without_scoring = await time_writes(user, write_count)
+    scorer.start()
+    with_scoring = await time_writes(user, write_count, scorer)
+    await scorer.close()
+
+    print(f"\033[1;34mAdding {write_count} messages without scoring: {describe(without_scoring)}\033[0m")
+    print(f"\033[1;34mAdding {write_count} messages while they are scored: {describe(with_scoring)}\033[0m")
+
+    # Scoring the messages added while scoring was off, and any turned away because the queue was full, as after a restart:
+    print(f"\033[1;34mCaught up on {await scorer.catch_up()} unscored messages.\033[0m")
+
+    await message_writer.close()
+    await async_engine.dispose()
+
+
+def count_unscored(user_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(Message).outerjoin(MessageInsight)
+                         .filter(Message.user_id == user_id, MessageInsight.id.is_(None)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--legacy", type=int, default=0, help="Score this many messages the way they were scored before.")
+    parser.add_argument("--writes", type=int, default=500)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    user_id = seed_messages(args.messages)
+
+    # Loading the model before anything is timed:
+    start = time.perf_counter()
+    KeywordExtractor().score_categories("warm up")
+    print(f"\033[1;34mLoaded the embedding model in {time.perf_counter() - start:.1f}s.\033[0m")
+
+    if args.legacy:
+        print(f"\033[1;32mLegacy: {legacy_score(user_id, args.legacy):.0f} messages/s.\033[0m")
+
+    asyncio.run(run(user_id, args.writes))
+    print(f"Messages left unscored: {count_unscored(user_id)}")
+
+
+if __name__ == "__main__":
+    main()
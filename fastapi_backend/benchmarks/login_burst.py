@@ -0,0 +1,96 @@
+import time
+import asyncio
+import argparse
+import statistics
+
+import httpx
+from dotenv import load_dotenv
+
+# Loading environment variables before local imports, as the database URL is read on import:
+load_dotenv()
+
+from ..main import app
+from ..database import SessionLocal, async_engine
+from ..models import User
+from ..security import bcrypt_context, create_access_token
+from ..rate_limiter import limiter
+from ..services import password_hashing
+
+# Measures how a burst of logins affects the latency of other requests to the same worker.
+# The latency of GET /user/ is measured on its own, then while the logins run, along with the login throughput
+# and how many logins were turned away because the password hashing workers were saturated.
+# This creates a benchmark user, so it should be run against a disposable database.
+# Usage: python -m fastapi_backend.benchmarks.login_burst [--logins 50] [--probes 200]
+
+PASSWORD = "benchmark-password"
+
+
+def seed_user() -> tuple:
+    with SessionLocal() as db:
+        user = User(name="Benchmark", email=f"benchmark-{time.time_ns()}@example.com", password=bcrypt_context.hash(PASSWORD))
+        db.add(user)
+        db.commit()
+        return user.id, user.email
+
+
+async def probe(client: httpx.AsyncClient, count: int, interval: float) -> list:
+    # Timing a cheap authenticated request at a steady rate:
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        (await client.get("/user/")).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def login(client: httpx.AsyncClient, email: str) -> int:
+    response = await client.post("/auth/token", data={"username": email, "password": PASSWORD})
+    return response.status_code
+
+
+def describe(latencies: list) -> str:
+    quantiles = statistics.quantiles(latencies, n=100)
+    return (f"p50 {quantiles[49] * 1000:.1f} ms, p95 {quantiles[94] * 1000:.1f} ms, "
+            f"max {max(latencies) * 1000:.1f} ms")
+
+
+async def run(user_id: int, email: str, login_count: int, probe_count: int) -> None:
+    headers = {"Authorization": f"Bearer {create_access_token(user_id)}"}
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", headers=headers) as client:
+        # Starting the workers and loading the user before anything is timed:
+        await login(client, email)
+
+        baseline = await probe(client, probe_count, 0.005)
+
+        start = time.perf_counter()
+        logins = asyncio.gather(*(login(client, email) for _ in range(login_count)))
+        during_burst, statuses = await asyncio.gather(probe(client, probe_count, 0.005), logins)
+        elapsed = time.perf_counter() - start
+
+    accepted = statuses.count(200)
+    print(f"\033[1;34mGET /user/ alone: {describe(baseline)}\033[0m")
+    print(f"\033[1;34mGET /user/ during {login_count} logins: {describe(during_burst)}\033[0m")
+    print(f"\033[1;32mLogins: {accepted} accepted ({accepted / elapsed:.1f}/s), "
+          f"{statuses.count(503)} turned away as busy, {len(statuses) - accepted - statuses.count(503)} failed.\033[0m")
+
+    password_hashing.password_pool.shutdown()
+    await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    # The burst is far more than the rate limits allow, and the limits aren't what is being measured:
+    limiter.enabled = False
+    user_id, email = seed_user()
+    asyncio.run(run(user_id, email, args.logins, args.probes))
+
+
+if __name__ == "__main__":
+    main()
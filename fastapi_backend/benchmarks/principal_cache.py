@@ -0,0 +1,119 @@
+import time
+import asyncio
+import argparse
+import random
+from collections import defaultdict
+
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+# Loading environment variables before local imports, as the database URL is read on import:
+load_dotenv()
+
+from ..main import app
+from ..database import SessionLocal, async_engine
+from ..models import User, Message
+from ..enums import MessageType, MessageFeedback
+from ..security import create_access_token
+from ..rate_limiter import limiter
+from ..services import principal_cache
+
+# Counts the DB queries per request for a mix of authenticated requests, with and without the principal cache.
+# The mix is weighted towards polling the messages, as clients do. This creates a benchmark user,
+# so it should be run against a disposable database.
+# Usage: python -m fastapi_backend.benchmarks.principal_cache [--requests 1000]
+
+# Each request in the mix, and how often it is made relative to the others:
+REQUEST_MIX = [
+    ("GET /assistant/messages", 6, lambda client, message_id: client.get("/assistant/messages")),
+    ("GET /user/", 3, lambda client, message_id: client.get("/user/")),
+    ("PUT feedback", 1, lambda client, message_id: client.put(
+        f"/assistant/messages/{message_id}/feedback", params={"feedback": MessageFeedback.POSITIVE.value}
+    )),
+]
+
+
+def seed_user() -> tuple:
+    with SessionLocal() as db:
+        user = User(name="Benchmark", email=f"benchmark-{time.time_ns()}@example.com", password="-")
+        db.add(user)
+        db.flush()
+
+        message = Message(user_id=user.id, type=MessageType.ASSISTANT, text="Benchmark message")
+        db.add(message)
+        db.commit()
+        return user.id, message.id
+
+
+async def run_mix(user_id: int, message_id: int, request_count: int, use_cache: bool) -> dict:
+    queries = defaultdict(int)
+    requests = defaultdict(int)
+    current = [None]
+
+    def count_query(*_):
+        if current[0] is not None: queries[current[0]] += 1
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_query)
+    principal_cache.clear()
+
+    headers = {"Authorization": f"Bearer {create_access_token(user_id)}"}
+    transport = httpx.ASGITransport(app=app)
+    names, weights, calls = zip(*REQUEST_MIX)
+    random.seed(0)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", headers=headers) as client:
+            for name in random.choices(range(len(names)), weights=weights, k=request_count):
+                # Without the cache, every request authenticates from scratch:
+                if not use_cache: principal_cache.clear()
+
+                current[0] = names[name]
+                response = await calls[name](client, message_id)
+                response.raise_for_status()
+                requests[names[name]] += 1
+    finally:
+        current[0] = None
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_query)
+
+    return {name: (requests[name], queries[name]) for name in names}
+
+
+def print_results(title: str, results: dict) -> int:
+    print(f"\033[1;34m{title}:\033[0m")
+    total_requests = total_queries = 0
+
+    for name, (request_count, query_count) in results.items():
+        print(f"  {name}: {request_count} requests, {query_count / max(request_count, 1):.2f} queries per request")
+        total_requests += request_count
+        total_queries += query_count
+
+    print(f"  Total: {total_queries} queries, {total_queries / max(total_requests, 1):.2f} per request")
+    return total_queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    # The mix is far more than the rate limits allow, and the limits aren't what is being measured:
+    limiter.enabled = False
+    user_id, message_id = seed_user()
+
+    async def run() -> tuple:
+        uncached = await run_mix(user_id, message_id, args.requests, use_cache=False)
+        cached = await run_mix(user_id, message_id, args.requests, use_cache=True)
+        await async_engine.dispose()
+        return uncached, cached
+
+    uncached, cached = asyncio.run(run())
+
+    uncached_queries = print_results("Without the principal cache", uncached)
+    cached_queries = print_results("With the principal cache", cached)
+    print(f"\033[1;32mSaved {uncached_queries - cached_queries} of {uncached_queries} queries "
+          f"({(uncached_queries - cached_queries) / args.requests:.2f} per request).\033[0m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import insert
+
+# Loading environment variables before local imports, as the database URL is read on import:
+load_dotenv()
+
+from ..database import engine, SessionLocal
+from ..models import Base, User, Message, MessageInsight
+from ..enums import MessageType, MessageFeedback, DescriptionCategory
+from ..services.ml_services.preference_prediction import prepare_training_data
+
+# Measures preparing the preference model's training data from a synthetic history, with the single streamed query
+# or (with --legacy) the previous approach of one query per user and one per message for its insights,
+# checking that both produce the same matrices.
+# This creates benchmark users and messages, so it should be run against a disposable database.
+# Usage: python -m fastapi_backend.benchmarks.training_data [--messages 1000000] [--users 1000] [--legacy]
+
+SEED_BATCH_SIZE = 10000
+
+# The feedback given to assistant messages, in turn - neutral ones aren't used for training:
+FEEDBACK = [MessageFeedback.POSITIVE, MessageFeedback.NEGATIVE, MessageFeedback.NEUTRAL]
+
+
+def seed_history(message_count: int, user_count: int) -> None:
+    with engine.begin() as conn:
+        suffix = time.time_ns()
+        user_ids = conn.scalars(insert(User).returning(User.id), [
+            {"name": "Benchmark", "email": f"benchmark-{suffix}-{index}@example.com", "password": "-"}
+            for index in range(user_count)
+        ]).all()
+
+    # Alternating user and assistant messages, each with a score for every category, as the insight scorer stores them:
+    rng = np.random.default_rng(42)
+    start_time = datetime(2024, 1, 1)
+
+    for start in range(0, message_count, SEED_BATCH_SIZE):
+        indices = range(start, min(start + SEED_BATCH_SIZE, message_count))
+        with engine.begin() as conn:
+            message_ids = conn.scalars(insert(Message).returning(Message.id, sort_by_parameter_order=True), [{
+                "user_id": user_ids[index % user_count],
+                "type": MessageType.USER if index % 2 == 0 else MessageType.ASSISTANT,
+                "text": "Benchmark message",
+                "timestamp": start_time + timedelta(seconds=index),
+                "feedback": MessageFeedback.NEUTRAL if index % 2 == 0 else FEEDBACK[index // 2 % len(FEEDBACK)],
+            } for index in indices]).all()
+
+            scores = rng.random((len(message_ids), len(DescriptionCategory)))
+            conn.execute(insert(MessageInsight), [
+                {"message_id": message_id, "category": category, "score": float(score)}
+                for message_id, message_scores in zip(message_ids, scores)
+                for category, score in zip(DescriptionCategory, message_scores)
+            ])
+
+
+def legacy_prepare_training_data(db) -> tuple:
+    # The previous implementation - the messages of each user, then the insights of each message, built up in lists:
+    categories = list(DescriptionCategory)
+    category_to_index = {category: idx for idx, category in enumerate(categories)}
+    training_data, labels = [], []
+
+    for user in db.query(User).all():
+        messages = db.query(Message).filter_by(user_id=user.id).order_by(Message.timestamp.asc()).all()
+        for message in messages:
+            message_insights = db.query(MessageInsight).filter_by(message_id=message.id).all()
+            if not message_insights: continue
+
+            feature_vector = [0.0] * len(categories)
+            for insight in message_insights: feature_vector[category_to_index[insight.category]] = insight.score
+
+            if message.type == MessageType.USER:
+                label_vector = feature_vector.copy()
+            elif message.type == MessageType.ASSISTANT and message.feedback != MessageFeedback.NEUTRAL:
+                adjustment = 1.0 if message.feedback == MessageFeedback.POSITIVE else -1.0
+                label_vector = [score * adjustment for score in feature_vector]
+            else:
+                continue
+
+            training_data.append(feature_vector)
+            labels.append(label_vector)
+
+    return np.array(training_data), np.array(labels)
+
+
+def measure(prepare) -> tuple:
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        training_data, labels = prepare(db)
+    elapsed = time.perf_counter() - start
+
+    # Tracing allocations slows everything down, so the memory is measured by preparing the data again:
+    tracemalloc.start()
+    with SessionLocal() as db:
+        prepare(db)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return training_data, labels, elapsed, peak_memory / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--legacy", action="store_true", help="Also prepare the data the way it was prepared before.")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    start = time.perf_counter()
+    seed_history(args.messages, args.users)
+    print(f"\033[1;34mSeeded {args.messages} messages from {args.users} users in {time.perf_counter() - start:.1f}s.\033[0m")
+
+    training_data, labels, elapsed, peak_memory = measure(prepare_training_data)
+    print(f"\033[1;32mStreamed: {len(training_data)} rows in {elapsed:.2f}s, peak Python memory {peak_memory:.1f} MB.\033[0m")
+
+    if not args.legacy: return
+    legacy_data, legacy_labels, elapsed, peak_memory = measure(legacy_prepare_training_data)
+    print(f"\033[1;32mLegacy: {len(legacy_data)} rows in {elapsed:.2f}s, peak Python memory {peak_memory:.1f} MB.\033[0m")
+
+    # The features are stored as float32, so they only match the legacy float64 values to that precision:
+    same = (training_data.shape == legacy_data.shape and np.allclose(training_data, legacy_data, atol=1e-6)
+            and np.allclose(labels, legacy_labels, atol=1e-6))
+    print(f"\033[1;{'32' if same else '31'}mThe training data {'matches' if same else 'does not match'} the legacy implementation.\033[0m")
+
+
+if __name__ == "__main__":
+    main()
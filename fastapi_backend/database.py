@@ -1,9 +1,14 @@
 import os
+import time
 
-from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy import create_engine, MetaData, text, event, exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
+from . import metrics
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 # If shared DB, set per service:
@@ -18,12 +23,82 @@ connect_args = {}
 if SCHEMA: connect_args["options"] = f"-csearch_path=\"{SCHEMA}\""
 
 
+# The most connections all processes of the service may open together, and how many worker processes share them.
+# Without a budget, each process keeps the previous fixed pool sizes:
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 0))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+
+# How long a request waits for a free connection before giving up:
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+# The sync engine is only used at startup and by background jobs, so it needs few connections.
+# With a budget, each process needs at least one connection for each engine:
+BUDGET_SYNC_POOL_SIZE, BUDGET_SYNC_MAX_OVERFLOW = 1, 1
+MIN_CONNECTIONS = BUDGET_SYNC_POOL_SIZE + 1
+
+
+def get_pool_sizes(max_connections: int, workers: int) -> tuple:
+    # Splitting this process's share of the budget between the sync engine and the request path,
+    # keeping a quarter of the request path's connections as overflow for bursts.
+    # Returns the pool size and overflow of the sync engine, then of the async engine:
+    if not max_connections: return 5, 2, 5, 2
+
+    budget = max_connections // max(1, workers)
+    if budget < MIN_CONNECTIONS:
+        raise ValueError(f"DB_MAX_CONNECTIONS of {max_connections} leaves {budget} connections for each of {workers} workers, "
+                         f"but each needs at least {MIN_CONNECTIONS}")
+
+    # The sync engine only overflows if that still leaves the request path at least two connections:
+    sync_overflow = BUDGET_SYNC_MAX_OVERFLOW if budget - BUDGET_SYNC_POOL_SIZE - BUDGET_SYNC_MAX_OVERFLOW >= 2 else 0
+    connections = budget - BUDGET_SYNC_POOL_SIZE - sync_overflow
+    pool_size = max(1, connections * 3 // 4)
+    return BUDGET_SYNC_POOL_SIZE, sync_overflow, pool_size, connections - pool_size
+
+
+SYNC_POOL_SIZE, SYNC_MAX_OVERFLOW, ASYNC_POOL_SIZE, ASYNC_MAX_OVERFLOW = get_pool_sizes(DB_MAX_CONNECTIONS, WEB_CONCURRENCY)
+
+
+class InstrumentedPoolMixin:
+    # Records how long each checkout waits for a connection, and how often none becomes free in time.
+    # The prefix is a class attribute, since pools are recreated from their class when an engine is disposed:
+    metrics_prefix = "db_pool"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            metrics.increment(f"{self.metrics_prefix}.timeouts")
+            raise
+        finally:
+            metrics.observe(f"{self.metrics_prefix}.wait_seconds", time.perf_counter() - start)
+
+        metrics.increment(f"{self.metrics_prefix}.checkouts")
+        return connection
+
+    def stats(self) -> dict:
+        return {"size": self.size(), "checked_out": self.checkedout(), "overflow": self.overflow(), "idle": self.checkedin()}
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    metrics_prefix = "db_pool.sync"
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_prefix = "db_pool.async"
+
+
+# SQLite connections aren't pooled the same way, so the pool settings only apply to server databases:
+sync_pool_args = {} if DATABASE_URL.startswith("sqlite") else {
+    "poolclass": InstrumentedQueuePool, "pool_size": SYNC_POOL_SIZE,
+    "max_overflow": SYNC_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+}
+
 engine = create_engine(
     DATABASE_URL,
-    pool_size=5,
-    max_overflow=2,
     future=True,
     connect_args=connect_args,
+    **sync_pool_args,
 )
 
 if SCHEMA:
@@ -31,3 +106,56 @@ if SCHEMA:
         conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}"))
 
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+
+def get_async_database_url(url: str) -> str:
+    # Using the async driver for the same database - asyncpg for Postgres, aiosqlite for local SQLite databases:
+    scheme, separator, rest = url.partition("://")
+    driver = scheme.split("+")[0]
+
+    if driver in ("postgres", "postgresql"): return f"postgresql+asyncpg{separator}{rest}"
+    if driver == "sqlite": return f"sqlite+aiosqlite{separator}{rest}"
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
+# asyncpg takes server settings rather than an options string:
+async_connect_args = {"server_settings": {"search_path": SCHEMA}} if SCHEMA and "asyncpg" in ASYNC_DATABASE_URL else {}
+
+# SQLite connections aren't pooled by the async driver, so the pool size only applies to server databases:
+async_pool_args = {} if ASYNC_DATABASE_URL.startswith("sqlite") else {
+    "poolclass": InstrumentedAsyncQueuePool, "pool_size": ASYNC_POOL_SIZE,
+    "max_overflow": ASYNC_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT,
+}
+
+# The request path uses the async engine, so that queries don't block the event loop or wait for threadpool workers.
+# The sync engine is still used for creating tables, migrations and background jobs:
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args=async_connect_args,
+    **async_pool_args,
+)
+
+# Objects stay usable after a commit, since reloading expired attributes isn't possible without an explicit await:
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+def enable_sqlite_foreign_keys(dbapi_connection, _) -> None:
+    # SQLite only enforces foreign keys (and so cascades deletes) when asked to, on each connection:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+if DATABASE_URL.startswith("sqlite"): event.listen(engine, "connect", enable_sqlite_foreign_keys)
+if ASYNC_DATABASE_URL.startswith("sqlite"): event.listen(async_engine.sync_engine, "connect", enable_sqlite_foreign_keys)
+
+
+def pool_stats() -> dict:
+    # Only the instrumented pools have stats - SQLite databases use the drivers' own pools:
+    pools = {"sync": engine.pool, "async": async_engine.sync_engine.pool}
+    return {name: pool.stats() for name, pool in pools.items() if isinstance(pool, InstrumentedPoolMixin)}
+
+
+metrics.register_gauge("db_pool", pool_stats)
@@ -1,39 +1,43 @@
-from typing import Annotated, Optional, Generator
+from typing import Annotated, Optional, AsyncGenerator
 
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import jwt, JWTError
 
-from .exceptions import JWTException, UserNotFoundException
-from .database import SessionLocal
+from .exceptions import JWTException, UserNotFoundException, AdminRequiredException
+from .database import AsyncSessionLocal
 from .models import User
 from .security import HASH_SECRET_KEY, HASH_ALGORITHM
+from .services import principal_cache
+from .services.principal_cache import UserSnapshot
 
 
 # Using generator as context manager to manage the DB session:
-def get_db() -> Generator[Session, None, None]:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
     # Creating a new session to connect to the DB, using the session factory:
-    db = SessionLocal()
+    db = AsyncSessionLocal()
     try:
         # Providing a DB session to the caller:
         yield db
     
     except Exception:
         # Rolling back any changes if an error occurs:
-        db.rollback()
+        await db.rollback()
         raise
     
     finally:
         # This code only runs after the function calling get_db completes, 
         # allowing the connection to be closed when no longer needed (and not too soon):
-        db.close()
+        await db.close()
 
 
-# Dependency injection - if an object of type db_dependency (which is of type Session) is not provided, 
+# Dependency injection - if an object of type db_dependency (which is of type AsyncSession) is not provided, 
 # FastAPI will automatically call get_db to obtain a DB session.
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 
 
 # For the authentication dependency, the OAuth2PasswordRequestForm class must be instantiated:
@@ -44,29 +48,52 @@ auth_dependency = Annotated[OAuth2PasswordRequestForm, Depends(OAuth2PasswordReq
 token_dependency = Annotated[str, Depends(OAuth2PasswordBearer(tokenUrl="auth/token"))]
 
 
-def get_current_user(db: db_dependency, token: token_dependency) -> User:
-    try:
-        # Attempting to decode the token using the secret key and algorithm:
-        # (If successful, this will return a dictionary that contains the user data)
-        payload = jwt.decode(token, HASH_SECRET_KEY, algorithms=[HASH_ALGORITHM])
+async def get_current_user(token: token_dependency) -> UserSnapshot:
+    # Tokens that have already been verified are looked up, rather than decoded and verified again:
+    user_id = principal_cache.get_token_subject(token)
+
+    if user_id is None:
+        try:
+            # Attempting to decode the token using the secret key and algorithm:
+            # (If successful, this will return a dictionary that contains the user data)
+            payload = jwt.decode(token, HASH_SECRET_KEY, algorithms=[HASH_ALGORITHM])
+
+            # Extracting the user ID from the payload dictionary:
+            # The subject of a JWT needs to be a string, so converting back to integer:
+            user_id: Optional[int] = payload.get("sub")
+
+            if user_id is None: raise JWTError
+            user_id = int(user_id)
 
-        # Extracting the user ID from the payload dictionary:
-        # The subject of a JWT needs to be a string, so converting back to integer:
-        user_id: Optional[int] = payload.get("sub")
+        except JWTError as e: raise JWTException from e
 
-        if user_id is None: raise JWTError
-        user_id = int(user_id)
+        principal_cache.set_token_subject(token, user_id, payload.get("exp"))
 
-    except JWTError as e: raise JWTException from e
+    # Recently authenticated users are served from memory, so most requests don't need to query the user:
+    principal = principal_cache.get_principal(user_id)
+    if principal is not None: return principal
 
-    return get_user(db, user_id)
+    # Using a session of its own, which returns its connection as soon as the user is loaded,
+    # rather than the request's session, which would keep it checked out for the rest of the request:
+    async with AsyncSessionLocal() as db:
+        return principal_cache.set_principal(await get_user(db, user_id))
 
 
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-def get_user(db: db_dependency, user_id: int) -> User:
-    user = db.query(User).filter_by(id=user_id).first()
+async def get_user(db: db_dependency, user_id: int) -> User:
+    # Joining the insights onto the user, since they are needed for the prompt and can't be lazily loaded in async code.
+    # This loads both in a single query, and the joined rows are combined back into one user by unique():
+    query = select(User).options(joinedload(User.insights)).filter_by(id=user_id)
+    user = (await db.execute(query)).unique().scalar_one_or_none()
     if user is None: raise UserNotFoundException
     return user
 
+
+def get_current_admin(user: user_dependency) -> UserSnapshot:
+    if not user.is_admin: raise AdminRequiredException
+    return user
+
+
+admin_dependency = Annotated[dict, Depends(get_current_admin)]
@@ -1,3 +1,15 @@
+import os
+
+from sqlalchemy import event
+
+from . import metrics
+from .models import UserInsight
+from .services.cache import TTLCache
+
+
+# Compiled prompts of recently active users, each stored with the insights it was compiled from:
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", 1000))
+
 ASSISTANT_CONTEXT = """
 You are In-Sight, a friendly screen-reader assistant that provides concise, impactful, 
 vivid descriptions of images for visually impaired users. 
@@ -26,15 +38,40 @@ For example, describe people or objects based on context
 This helps avoid vague or hesitant language that could be confusing or frustrating to the user.
 """
 
+_prompts = TTLCache(PROMPT_CACHE_SIZE)
+
+
+def compile_prompt(category_scores: tuple) -> str:
+    lines = [ASSISTANT_CONTEXT, "Roughly the following percentages of your response should focus on the following categories:"]
+    lines += [f"{category_name} - {score * 100:.2f}%" for category_name, score in category_scores]
+    return "\n".join(lines)
+
+
 def get_dynamic_prompt(user=None):
-    result = ASSISTANT_CONTEXT
+    if not user: return ASSISTANT_CONTEXT
+
+    # The insights are loaded with the user, and the prompt is only compiled again if they have changed.
+    # Comparing the scores themselves means a prompt cached before another worker changed them is never used:
+    category_scores = tuple((insight.category.name, insight.score) for insight in user.insights)
+
+    cached = _prompts.get(user.id)
+    if cached is not None and cached[0] == category_scores:
+        metrics.increment("prompt_cache.hits")
+        return cached[1]
+
+    metrics.increment("prompt_cache.misses")
+    prompt = compile_prompt(category_scores)
+    _prompts.set(user.id, (category_scores, prompt))
+    return prompt
+
 
-    if not user: return result
-    
-    category_scores = {insight.category.name: insight.score for insight in user.insights}
+def invalidate(user_id: int) -> None:
+    _prompts.delete(user_id)
 
-    result += "\nRoughly the following percentages of your response should focus on the following categories:"
-    for category_name, score in category_scores.items():
-        result += f"\n{category_name} - {score * 100:.2f}%"
 
-    return result
+@event.listens_for(UserInsight, "after_insert")
+@event.listens_for(UserInsight, "after_update")
+@event.listens_for(UserInsight, "after_delete")
+def invalidate_insight_user(mapper, connection, insight: UserInsight) -> None:
+    # Dropping the compiled prompt as soon as an insight is written through the ORM, rather than waiting to be replaced:
+    invalidate(insight.user_id)
@@ -43,3 +43,16 @@ class OpenAIVoice(Enum):
     ONYX = 'onyx'
     NOVA = 'nova'
     SHIMMER = 'shimmer'
+
+
+class UpstreamStage(Enum):
+    COMPLETION = 'completion'
+    STT = 'stt'
+    TTS = 'tts'
+    NEUPHONIC = 'neuphonic'
+
+
+class ImageDetail(Enum):
+    LOW = 'low'
+    HIGH = 'high'
+    AUTO = 'auto'
@@ -41,3 +41,23 @@ class MessageNotFoundException(HTTPException):
         super().__init__(status_code=st.HTTP_404_NOT_FOUND, detail=detail)
 
 
+class AdminRequiredException(HTTPException):
+    def __init__(self, detail="You do not have permission to access this resource."):
+        super().__init__(status_code=st.HTTP_403_FORBIDDEN, detail=detail)
+
+
+class RangeNotSatisfiableException(HTTPException):
+    def __init__(self, size: int, detail="The requested range is not available."):
+        super().__init__(status_code=st.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, detail=detail,
+                         headers={"Content-Range": f"bytes */{size}"})
+
+
+class InvalidCursorException(HTTPException):
+    def __init__(self, detail="The page cursor is not valid. Please start again from the first page."):
+        super().__init__(status_code=st.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+class ServerBusyException(HTTPException):
+    def __init__(self, retry_after: int = 1, detail="The server is busy. Please try again in a moment."):
+        super().__init__(status_code=st.HTTP_503_SERVICE_UNAVAILABLE, detail=detail,
+                         headers={"Retry-After": str(retry_after)})
@@ -1,6 +1,9 @@
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from .exceptions import ServerBusyException
 
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """
@@ -17,3 +20,11 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         
         errors.append(f"{field} {message}.")
     return JSONResponse(status_code=422, content={"detail": " ".join(errors)})
+
+
+async def pool_timeout_exception_handler(request: Request, exc: PoolTimeoutError):
+    """
+    Responds to requests that couldn't get a DB connection in time as busy, so that clients retry later.
+    """
+    busy = ServerBusyException()
+    return JSONResponse(status_code=busy.status_code, content={"detail": busy.detail}, headers=busy.headers)
@@ -4,6 +4,7 @@ from slowapi.middleware import SlowAPIMiddleware
 from fastapi.exceptions import RequestValidationError
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from dotenv import load_dotenv
 import uvicorn
 import os
@@ -16,9 +17,16 @@ app = FastAPI()
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from .handlers import validation_exception_handler
-from .routers import root, assistant, auth, users
+from .handlers import validation_exception_handler, pool_timeout_exception_handler
+from .routers import root, assistant, auth, users, metrics
 from .database import engine
+from .services import upstream, image_processing, password_hashing
+from .services.message_writer import message_writer
+from .services.insight_scorer import insight_scorer, INSIGHT_SCORING
+from .migrations.audio_blobs import add_audio_ref_column
+from .migrations.message_history_index import add_history_index
+from .migrations.cascade_deletes import add_cascade_deletes
+from .migrations.history_version import add_history_version_column
 from . import models
 
 from .rate_limiter import limiter
@@ -30,6 +38,8 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Allowing the browser to read the cursor of the next page of messages:
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.state.limiter = limiter
@@ -38,33 +48,59 @@ app.add_middleware(SlowAPIMiddleware)
 
 # Creating tables if they don't already exist:
 models.Base.metadata.create_all(bind=engine)
+add_audio_ref_column(engine)
+add_history_index(engine)
+add_cascade_deletes(engine)
+add_history_version_column(engine)
 
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
+app.add_exception_handler(PoolTimeoutError, pool_timeout_exception_handler)
 
 # Including routers:
 app.include_router(root.router)
 app.include_router(assistant.router)
 app.include_router(auth.router)
 app.include_router(users.router)
+app.include_router(metrics.router)
 
-# from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.background import BackgroundScheduler
+from .services import archival
 # from .services.ml_services.preference_prediction import schedule_model_training, shutdown_scheduler
 
-# Initialize scheduler - TODO: Local only, too memory-expensive for Render hosting:
-# scheduler = BackgroundScheduler()
+# Initialize scheduler - the model training is local only, too memory-expensive for Render hosting:
+scheduler = BackgroundScheduler()
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     print("\033[1;32mApplication startup successful.\033[0m")
     
     # Scheduling the training - TODO: Local only, too memory-expensive for Render hosting:
     # schedule_model_training(scheduler)
     print("\033[1;34mScheduler started and model training job scheduled.\033[0m")
 
+    # Moving old messages out of the messages table, if a retention period is set:
+    if archival.ARCHIVE_AFTER_DAYS:
+        archival.schedule_archival(scheduler)
+        scheduler.start()
+
+    # Starting the insight scoring, which first catches up on any messages that weren't scored before the last shutdown:
+    if INSIGHT_SCORING: insight_scorer.start()
+
 @app.on_event("shutdown")
-def shutdown_event():
-    # Shutting down the scheduler - TODO: Local only, too memory-expensive for Render hosting:
-    # shutdown_scheduler(scheduler)
+async def shutdown_event():
+    # Writing any messages still queued:
+    await message_writer.close()
+    await insight_scorer.close()
+
+    # Closing the pooled connections to the upstream APIs:
+    await upstream.close_client()
+
+    # Stopping the image processing and password hashing workers:
+    image_processing.image_pool.shutdown()
+    password_hashing.password_pool.shutdown()
+
+    # Shutting down the scheduler:
+    if scheduler.running: scheduler.shutdown(wait=False)
     print("\033[1;31mApplication shutdown\033[0m")
 
 if __name__ == "__main__":
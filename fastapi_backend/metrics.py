@@ -0,0 +1,48 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+
+# Process-wide counters and timings - each worker process reports its own values:
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_observations: Dict[str, Dict[str, float]] = {}
+
+# Gauges are computed when the metrics are read, e.g. the current size of a cache:
+_gauges: Dict[str, Callable[[], dict]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def get_counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name: str, value: float) -> None:
+    # Keeping the count, total and maximum, which is enough to derive the mean:
+    with _lock:
+        observation = _observations.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        observation["count"] += 1
+        observation["total"] += value
+        observation["max"] = max(observation["max"], value)
+
+
+def register_gauge(name: str, function: Callable[[], dict]) -> None:
+    _gauges[name] = function
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        observations = {
+            name: {**observation, "mean": observation["total"] / observation["count"]}
+            for name, observation in _observations.items()
+        }
+
+    gauges = {name: function() for name, function in _gauges.items()}
+
+    return {"counters": counters, "observations": observations, "gauges": gauges}
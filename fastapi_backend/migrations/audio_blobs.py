@@ -0,0 +1,72 @@
+import base64
+
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+# Loading environment variables before local imports, as the database URL is read on import:
+load_dotenv()
+
+from ..database import engine, SessionLocal, SCHEMA
+from ..models import Message
+from ..services.blob_store import blob_store
+
+# Moves the base64 audio stored in messages.encoded_audio into the blob store.
+# Each batch is committed separately and migrated rows are cleared, so the migration can be stopped and resumed.
+# Usage: python -m fastapi_backend.migrations.audio_blobs [--drop-column]
+
+
+def get_message_columns(engine: Engine) -> set:
+    return {column["name"] for column in inspect(engine).get_columns(Message.__tablename__, schema=SCHEMA)}
+
+
+def add_audio_ref_column(engine: Engine) -> None:
+    # create_all doesn't add columns to existing tables, so this runs at startup:
+    if "audio_ref" not in get_message_columns(engine):
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {Message.__table__.fullname} ADD COLUMN audio_ref VARCHAR"))
+
+
+def migrate_audio(batch_size: int = 100, drop_column: bool = False) -> int:
+    add_audio_ref_column(engine)
+    if "encoded_audio" not in get_message_columns(engine): return 0
+
+    table = Message.__table__.fullname
+    migrated = 0
+
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.execute(text(
+                f"SELECT id, encoded_audio FROM {table} WHERE encoded_audio IS NOT NULL ORDER BY id LIMIT :limit"
+            ), {"limit": batch_size}).all()
+            if not rows: break
+
+            for message_id, encoded_audio in rows:
+                audio = base64.b64decode(encoded_audio)
+
+                # OpenAI audio is MP3, while Neuphonic audio is a WAV file, which starts with a RIFF header:
+                audio_format = "wav" if audio.startswith(b"RIFF") else "mp3"
+                audio_ref = blob_store.put(audio, audio_format, prefix="audio")
+
+                db.execute(text(f"UPDATE {table} SET audio_ref = :audio_ref, encoded_audio = NULL WHERE id = :id"),
+                           {"audio_ref": audio_ref, "id": message_id})
+            db.commit()
+
+        finally:
+            db.close()
+
+        migrated += len(rows)
+        print(f"\033[1;34mMigrated audio of {migrated} messages.\033[0m")
+
+    if drop_column:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN encoded_audio"))
+        print(f"\033[1;34mDropped the encoded_audio column.\033[0m")
+
+    return migrated
+
+
+if __name__ == "__main__":
+    import sys
+    migrate_audio(drop_column="--drop-column" in sys.argv)
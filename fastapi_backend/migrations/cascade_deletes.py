@@ -0,0 +1,40 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from ..database import SCHEMA
+from ..models import Message, MessageInsight, UserInsight
+
+# Makes the foreign keys of existing databases delete the rows referencing a deleted user or message,
+# and indexes the referencing columns, so that the cascades don't scan whole tables.
+# create_all only sets these up along with new tables, so this runs at startup.
+# SQLite can't alter constraints, so existing SQLite databases need to be recreated instead.
+
+CASCADE_FOREIGN_KEYS = [(UserInsight, "user_id"), (Message, "user_id"), (MessageInsight, "message_id")]
+
+
+def add_cascade_deletes(engine: Engine) -> None:
+    for model, column_name in CASCADE_FOREIGN_KEYS:
+        column = model.__table__.c[column_name]
+        for index in model.__table__.indexes:
+            if list(index.columns) == [column]: index.create(bind=engine, checkfirst=True)
+
+    if engine.dialect.name != "postgresql": return
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for model, column_name in CASCADE_FOREIGN_KEYS:
+            table = model.__table__.fullname
+            referred_table = next(iter(model.__table__.c[column_name].foreign_keys)).column.table.fullname
+
+            for foreign_key in inspector.get_foreign_keys(model.__tablename__, schema=SCHEMA):
+                if foreign_key["constrained_columns"] != [column_name]: continue
+                if foreign_key.get("options", {}).get("ondelete", "").upper() == "CASCADE": continue
+
+                # Replacing the constraint in the same transaction, so that it is never missing:
+                name = foreign_key["name"]
+                conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+                conn.execute(text(
+                    f'ALTER TABLE {table} ADD CONSTRAINT "{name}" FOREIGN KEY ({column_name}) '
+                    f'REFERENCES {referred_table} (id) ON DELETE CASCADE'
+                ))
+                print(f"\033[1;34mAdded ON DELETE CASCADE to {table}.{column_name}.\033[0m")
@@ -0,0 +1,16 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from ..database import SCHEMA
+from ..models import User
+
+# Adds the users.history_version column, used to check cached message histories, to existing databases.
+# create_all doesn't add columns to existing tables, so this runs at startup.
+
+
+def add_history_version_column(engine: Engine) -> None:
+    columns = {column["name"] for column in inspect(engine).get_columns(User.__tablename__, schema=SCHEMA)}
+
+    if "history_version" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {User.__table__.fullname} ADD COLUMN history_version INTEGER NOT NULL DEFAULT 0"))
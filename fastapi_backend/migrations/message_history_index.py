@@ -0,0 +1,12 @@
+from sqlalchemy.engine import Engine
+
+from ..models import Message
+
+# Adds the (user_id, timestamp, id) index used to paginate the message history to existing databases.
+# create_all only creates indexes along with new tables, so this runs at startup.
+
+
+def add_history_index(engine: Engine) -> None:
+    for index in Message.__table__.indexes:
+        if index.name == "ix_messages_user_id_timestamp_id":
+            index.create(bind=engine, checkfirst=True)
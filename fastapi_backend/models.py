@@ -1,6 +1,6 @@
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, DateTime, Boolean, Float
+from sqlalchemy import Column, Integer, String, ForeignKey, Enum, DateTime, Boolean, Float, Index
 
 from .database import Base
 from .enums import MessageType, DescriptionCategory, MessageFeedback
@@ -13,15 +13,20 @@ class User(Base):
     email = Column(String, index=True, unique=True, nullable=False)
     password = Column(String, nullable=False)
     is_admin = Column(Boolean, default=False)
+    # Incremented with every change to the user's messages, so that cached copies of the history can be checked cheaply:
+    history_version = Column(Integer, nullable=False, default=0, server_default="0")
 
-    messages = relationship("Message", back_populates="user", cascade="all, delete-orphan")
-    insights = relationship("UserInsight", back_populates="user", cascade="all, delete-orphan")
+    # The database deletes the messages and insights of a deleted user, so they aren't loaded to be deleted one by one:
+    messages = relationship("Message", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    # Ordered, so that the prompt compiled from the insights is the same every time they are loaded:
+    insights = relationship("UserInsight", back_populates="user", cascade="all, delete-orphan", passive_deletes=True,
+                            order_by="UserInsight.id")
 
 
 class UserInsight(Base):
     __tablename__ = "user_insights"
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     category = Column(Enum(DescriptionCategory), nullable=False)
     score = Column(Float, default=1.0)
 
@@ -32,22 +37,49 @@ class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True)
     # null if system message that applies to all users:
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True, index=True)
     type = Column(Enum(MessageType), nullable=False, index=True)
     text = Column(String, nullable=False)
-    encoded_audio = Column(String, nullable=True)
+    # Key of the message's audio in the blob store, since audio is too large to keep in this table:
+    audio_ref = Column(String, nullable=True)
     timestamp = Column(DateTime, server_default=func.now(), index=True)
     feedback = Column(Enum(MessageFeedback), default=MessageFeedback.NEUTRAL)
 
     user = relationship("User", back_populates="messages")
-    insights = relationship("MessageInsight", back_populates="message", cascade="all, delete-orphan")
+    insights = relationship("MessageInsight", back_populates="message", cascade="all, delete-orphan", passive_deletes=True)
+
+    # Matches the order the history is paginated in, so that each page is a single index range scan:
+    __table_args__ = (Index("ix_messages_user_id_timestamp_id", "user_id", "timestamp", "id"),)
 
 
 class MessageInsight(Base):
     __tablename__ = "message_insights"
     id = Column(Integer, primary_key=True)
-    message_id = Column(Integer, ForeignKey("messages.id"), nullable=False)
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False, index=True)
     category = Column(Enum(DescriptionCategory), nullable=False)
     score = Column(Float, default=1.0)
 
     message = relationship("Message", back_populates="insights")
+
+
+# Messages older than the retention period are moved here by the archival job, keeping their IDs,
+# so that the messages table (and every query on it) only holds recent messages:
+class ArchivedMessage(Base):
+    __tablename__ = "archived_messages"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    type = Column(Enum(MessageType), nullable=False)
+    text = Column(String, nullable=False)
+    # Key of the gzip-compressed audio in the blob store:
+    audio_ref = Column(String, nullable=True)
+    timestamp = Column(DateTime, index=True)
+    feedback = Column(Enum(MessageFeedback), default=MessageFeedback.NEUTRAL)
+    archived_at = Column(DateTime, server_default=func.now())
+
+
+class ArchivedMessageInsight(Base):
+    __tablename__ = "archived_message_insights"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    message_id = Column(Integer, ForeignKey("archived_messages.id", ondelete="CASCADE"), nullable=False, index=True)
+    category = Column(Enum(DescriptionCategory), nullable=False)
+    score = Column(Float, default=1.0)
@@ -1,11 +1,11 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, status as st, UploadFile, File, Form, Request, HTTPException, Depends
+from fastapi import APIRouter, status as st, UploadFile, File, Form, Request, Response, Query, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from starlette.requests import Request
-from sqlalchemy.orm import Session
 
 from ..rate_limiter import limiter
-from ..enums import AIModel, TTSModel, OpenAIVoice, MessageFeedback
+from ..enums import AIModel, TTSModel, OpenAIVoice, MessageFeedback, ImageDetail
 from ..services import assistant_service
 from ..schemas import MessageResponse
 from ..dependencies import db_dependency, user_dependency, get_db, get_current_user
@@ -14,27 +14,63 @@ router = APIRouter(prefix="/assistant", tags=["Assistant"])
 
 @router.post("/completion", response_model=MessageResponse, status_code=st.HTTP_201_CREATED)
 @limiter.limit("5/minute")
-async def completion(db: db_dependency, user: user_dependency, request: Request,
+async def completion(user: user_dependency, request: Request,
                      text: Optional[str] = Form(None), audio: UploadFile = File(None), 
                      image: UploadFile = File(None), encoded_image: Optional[str] = Form(None),
                      model: AIModel = Form(AIModel.GPT_4O), generate_audio: bool = Form(False),
-                     tts_model: TTSModel = Form(TTSModel.OPENAI), openai_voice: OpenAIVoice = Form(OpenAIVoice.ALLOY)):
+                     tts_model: TTSModel = Form(TTSModel.OPENAI), openai_voice: OpenAIVoice = Form(OpenAIVoice.ALLOY),
+                     image_detail: ImageDetail = Form(ImageDetail.AUTO)):
 
-    return await assistant_service.completion(db, user, text, audio, image, encoded_image, model, generate_audio, tts_model, openai_voice)
+    return await assistant_service.completion(user, text, audio, image, encoded_image, model, generate_audio, tts_model, openai_voice,
+                                              image_detail=image_detail)
 
 
+# Sends the response as server-sent events - 'token' events while it is generated, then the saved 'message':
+@router.post("/completion/stream", status_code=st.HTTP_200_OK)
+@limiter.limit("5/minute")
+async def stream_completion(user: user_dependency, request: Request,
+                            text: Optional[str] = Form(None), audio: UploadFile = File(None), 
+                            image: UploadFile = File(None), encoded_image: Optional[str] = Form(None),
+                            model: AIModel = Form(AIModel.GPT_4O), generate_audio: bool = Form(False),
+                            tts_model: TTSModel = Form(TTSModel.OPENAI), openai_voice: OpenAIVoice = Form(OpenAIVoice.ALLOY),
+                            image_detail: ImageDetail = Form(ImageDetail.AUTO)):
+
+    events = await assistant_service.stream_completion(user, text, audio, image, encoded_image, model, generate_audio, tts_model, openai_voice,
+                                                       image_detail=image_detail)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+# Returns the newest messages, oldest first - the X-Next-Cursor header holds the cursor of the page of older messages, if any:
 @router.get("/messages", response_model=List[MessageResponse], status_code=st.HTTP_200_OK)
 @limiter.limit("")
-async def read_messages(db: db_dependency, user: user_dependency, request: Request):
-    return assistant_service.get_user_messages(db, user)
+async def read_messages(db: db_dependency, user: user_dependency, request: Request, response: Response,
+                        limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = Query(None), include_audio: bool = Query(False)):
+    messages, next_cursor = await assistant_service.get_user_messages(db, user, limit, cursor, include_audio)
+    if next_cursor: response.headers["X-Next-Cursor"] = next_cursor
+    return messages
+
+
+# Streams Neuphonic speech for the text as a WAV file, sending the audio in chunks as it is synthesized:
+@router.post("/speech/stream", response_class=StreamingResponse, status_code=st.HTTP_200_OK)
+@limiter.limit("20/minute")
+async def stream_speech(user: user_dependency, request: Request, text: str = Form(..., min_length=1, max_length=4096)):
+    chunks = await assistant_service.stream_speech(text)
+    return StreamingResponse(chunks, media_type="audio/wav")
+
+
+# Streams the raw audio of a message, supporting range requests so that players can seek:
+@router.get("/messages/{message_id}/audio", response_class=StreamingResponse, status_code=st.HTTP_200_OK)
+async def read_message_audio(db: db_dependency, user: user_dependency, message_id: int, request: Request):
+    audio_ref = await assistant_service.get_message_audio(db, user, message_id)
+    return assistant_service.audio_response(audio_ref, request.headers.get("range"))
 
 
 @router.put("/messages/{message_id}/feedback", status_code=st.HTTP_204_NO_CONTENT)
 async def update_message_feedback(db: db_dependency, user: user_dependency, message_id: int, feedback: MessageFeedback):
-    assistant_service.add_message_feedback(db, user, message_id, feedback)
+    await assistant_service.add_message_feedback(db, user, message_id, feedback)
 
 
 @router.delete("/messages", status_code=st.HTTP_204_NO_CONTENT)
 @limiter.limit("")
 async def delete_messages(db: db_dependency, user: user_dependency, request: Request):
-    assistant_service.delete_messages(db, user)
\ No newline at end of file
+    await assistant_service.delete_messages(db, user)
\ No newline at end of file
@@ -13,4 +13,4 @@ router = APIRouter(prefix="/auth", tags=["User Authentication"])
 @router.post("/token", response_model=TokenResponse, status_code=st.HTTP_200_OK)
 @limiter.limit("60/hour")
 async def login_and_generate_token(db: db_dependency, auth_form: auth_dependency, request: Request):
-    return aus.login_and_generate_token(db, auth_form)
\ No newline at end of file
+    return await aus.login_and_generate_token(db, auth_form)
\ No newline at end of file
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, status as st
+
+from .. import metrics
+from ..dependencies import admin_dependency
+
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+# Counters are per worker process, so each call reports the worker that handled it:
+@router.get("/", status_code=st.HTTP_200_OK)
+async def read_metrics(_: admin_dependency):
+    return metrics.snapshot()
@@ -13,7 +13,7 @@ router = APIRouter(prefix="/user", tags=["User"])
 @router.post("/", response_model=UserResponse, status_code=st.HTTP_201_CREATED)
 @limiter.limit("")
 async def create_user(db: db_dependency, user_data: CreateUserRequest, request: Request):
-    return us.create_user(db, user_data)
+    return await us.create_user(db, user_data)
 
 
 @router.get("/", response_model=UserResponse, status_code=st.HTTP_200_OK)
@@ -24,4 +24,4 @@ async def read_current_user(user: user_dependency, request: Request):
 @router.delete("/", status_code=st.HTTP_204_NO_CONTENT)
 @limiter.limit("")
 async def delete_user(db: db_dependency, user: user_dependency, request: Request):
-    us.delete_user(db, user)
+    await us.delete_user(db, user)
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, computed_field
 
 from .enums import MessageType, MessageFeedback
 
@@ -29,7 +29,14 @@ class MessageResponse(BaseModel):
     id: int
     type: MessageType = Field()
     text: Optional[str] = Field(None)
+    # Only included in completion responses - the audio of other messages is downloaded from audio_url:
     encoded_audio: Optional[str] = Field(None)
+    audio_ref: Optional[str] = Field(None, exclude=True)
     feedback: MessageFeedback = Field()
 
+    @computed_field
+    @property
+    def audio_url(self) -> Optional[str]:
+        return f"/assistant/messages/{self.id}/audio" if self.audio_ref else None
+
     class Config: from_attributes = True
@@ -0,0 +1,128 @@
+import os
+import gzip
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select, insert, update, delete
+from apscheduler.schedulers.background import BackgroundScheduler
+
+# Loading environment variables before local imports, as the database URL is read on import:
+load_dotenv()
+
+from .. import metrics
+from ..database import SessionLocal
+from ..models import User, Message, MessageInsight, ArchivedMessage, ArchivedMessageInsight
+from .blob_store import blob_store
+
+# Moves messages older than the retention period, with their insights, into the archive tables,
+# compressing their audio into cold storage in the blob store.
+# Each batch is moved in its own transaction, so the job can be stopped at any point and picks up where it left off.
+# Usage: python -m fastapi_backend.services.archival [--days 180] [--batch-size 500] [--max-batches 0]
+
+# Messages are archived once they are this many days old - archival is disabled if this isn't set:
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 0))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+
+# Each scheduled run stops after this many batches, so that it never holds the database for long:
+ARCHIVE_MAX_BATCHES = int(os.getenv("ARCHIVE_MAX_BATCHES", 100))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv("ARCHIVE_INTERVAL_HOURS", 6))
+
+MESSAGE_COLUMNS = ["id", "user_id", "type", "text", "timestamp", "feedback"]
+
+
+def compress_audio(audio_ref: str) -> str:
+    data = b"".join(blob_store.read(audio_ref))
+    # Without a modification time, the same audio always compresses to the same bytes:
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    metrics.increment("archival.audio_bytes_saved", len(data) - len(compressed))
+
+    extension = audio_ref.rsplit(".", 1)[-1]
+    return blob_store.put(compressed, f"{extension}.gz", prefix="archive")
+
+
+def archive_batch(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    compressed_refs = {}
+
+    with SessionLocal() as db:
+        try:
+            # Locking the batch, so that jobs running in other workers skip these messages rather than archive them twice.
+            # Messages without a user are system messages that apply to all users, so they are kept:
+            messages = db.execute(
+                select(Message).filter(Message.timestamp < cutoff, Message.user_id.isnot(None))
+                .order_by(Message.timestamp, Message.id).limit(batch_size).with_for_update(skip_locked=True)
+            ).scalars().all()
+            if not messages: return 0
+
+            for message in messages:
+                if message.audio_ref: compressed_refs[message.id] = compress_audio(message.audio_ref)
+
+            message_ids = [message.id for message in messages]
+            db.execute(insert(ArchivedMessage), [
+                {**{column: getattr(message, column) for column in MESSAGE_COLUMNS}, "audio_ref": compressed_refs.get(message.id)}
+                for message in messages
+            ])
+            db.execute(insert(ArchivedMessageInsight).from_select(
+                ["id", "message_id", "category", "score"],
+                select(MessageInsight.id, MessageInsight.message_id, MessageInsight.category, MessageInsight.score)
+                .filter(MessageInsight.message_id.in_(message_ids))
+            ))
+
+            # The insights of the messages are removed by the database, through the ON DELETE CASCADE foreign key:
+            db.execute(delete(Message).where(Message.id.in_(message_ids)))
+
+            # Letting every worker know that the users' cached histories have changed:
+            user_ids = {message.user_id for message in messages}
+            db.execute(update(User).where(User.id.in_(user_ids)).values(history_version=User.history_version + 1))
+            db.commit()
+
+        except Exception:
+            # Removing the compressed copies, since the messages still refer to the original audio:
+            db.rollback()
+            blob_store.delete_many(compressed_refs.values())
+            raise
+
+    # Deleting the original audio only once no message refers to it:
+    blob_store.delete_many(message.audio_ref for message in messages if message.audio_ref)
+
+    metrics.increment("archival.messages", len(messages))
+    return len(messages)
+
+
+def archive_messages(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                     max_batches: Optional[int] = ARCHIVE_MAX_BATCHES) -> int:
+    # Timestamps are stored by the database in UTC without a time zone:
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    archived, batches = 0, 0
+
+    while not max_batches or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        archived += count
+        batches += 1
+        if count < batch_size: break
+
+    print(f"\033[1;34mArchived {archived} messages older than {cutoff:%Y-%m-%d}.\033[0m")
+    return archived
+
+
+def archive_messages_job() -> None:
+    try: archive_messages()
+    except Exception as e: print(f"\033[1;31mError during message archival: {e}\033[0m")
+
+
+def schedule_archival(scheduler: BackgroundScheduler) -> None:
+    # Only one run at a time - a run that is still going when the next is due makes it skip:
+    scheduler.add_job(archive_messages_job, "interval", hours=ARCHIVE_INTERVAL_HOURS, id="archive_messages",
+                      max_instances=1, coalesce=True, next_run_time=datetime.now())
+    print(f"\033[1;34mMessage archival scheduled every {ARCHIVE_INTERVAL_HOURS:g} hours.\033[0m")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS or 180)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, default=0, help="0 archives every old message.")
+    args = parser.parse_args()
+
+    archive_messages(args.days, args.batch_size, args.max_batches)
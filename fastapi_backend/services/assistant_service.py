@@ -1,86 +1,111 @@
 import os
+import json
 import base64
-import requests
-import io
-from io import BytesIO
-from typing import List, Optional
-import wave
+import binascii
+from typing import List, Optional, Tuple, AsyncGenerator
 
-from openai import OpenAI
 from fastapi import UploadFile, HTTPException
+from fastapi.responses import StreamingResponse
 from pyneuphonic import Neuphonic, TTSConfig
+from pyneuphonic.models import SSEResponse, to_dict
 from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, delete, tuple_
 
-# from .ml_services.keyword_extraction import KeywordExtractor
 # from .ml_services.preference_prediction import predict_preferences
 
-from ..exceptions import NoMessageException, UnprocessableMessageException, APIRequestException, MessageNotFoundException
+from . import upstream, completion_cache, speech_cache, image_processing, context_builder
+from .stage_graph import StageGraph
+from .speech_pipeline import TEXT, wav_header, stitch_audio, pipeline_speech, STREAMING_WAV_DATA_SIZE
+from .blob_store import blob_store
+from .message_writer import message_writer
+from .insight_scorer import insight_scorer, INSIGHT_SCORING
+from ..exceptions import NoMessageException, UnprocessableMessageException, APIRequestException, MessageNotFoundException, RangeNotSatisfiableException, \
+    InvalidCursorException
 from ..dependencies import db_dependency, user_dependency
-from ..models import Message, UserInsight
+from ..models import Message, ArchivedMessage, UserInsight
+from ..schemas import MessageResponse
 from ..dynamic_prompts import get_dynamic_prompt
-from ..enums import MessageType, AIModel, TTSModel, OpenAIVoice, MessageFeedback, DescriptionCategory
-
-client = OpenAI()
+from ..enums import MessageType, AIModel, TTSModel, OpenAIVoice, MessageFeedback, DescriptionCategory, UpstreamStage, ImageDetail
 
 # Load API key at startup before env vars are cleared:
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Initializing the Neuphonic client:
+COMPLETIONS_URL = "https://api.openai.com/v1/chat/completions"
+
+# How many messages are deleted per transaction, so that long histories don't hold locks for long:
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", 1000))
+
+# The audio format produced by each TTS model:
+AUDIO_FORMATS = {TTSModel.OPENAI: "mp3", TTSModel.NEUPHONIC: "wav"}
+AUDIO_MEDIA_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+
+# Initializing the Neuphonic client - only used for its URL and headers, requests go through the shared client:
 neuphonic_client = Neuphonic(api_key=os.environ.get('NEUPHONIC_API_KEY'))
+neuphonic_sse = neuphonic_client.tts.SSEClient()
 
-# Initializing the nlp extractor - TODO: Local only, too memory-expensive for Render hosting:
-# keyword_extractor = KeywordExtractor()
 
+def encode_cursor(message_id: int) -> str:
+    # The cursor is the last message sent, so the next page continues from there:
+    return base64.urlsafe_b64encode(json.dumps(message_id).encode("utf-8")).decode("utf-8")
 
-def get_messages(db: db_dependency, user: user_dependency, limit: int = 20) -> List[Message]:
-    user_messages = get_user_messages(db, user, limit)
-    system_prompt = get_dynamic_prompt(user)
-    return format_messages([Message(type=MessageType.SYSTEM, text=system_prompt)] + user_messages, user)
 
+def decode_cursor(cursor: str) -> int:
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8"))))
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise InvalidCursorException from e
 
-# Returns messages between a specific user and the assistant:
-def get_user_messages(db: db_dependency, user: user_dependency, limit: int = 20) -> List[Message]:
-    # Combining desc and then reversing the order may seem redundant, 
-    # but this way we get only the last X messages, with the oldest message appearing first:
-    result = db.query(Message).filter_by(user_id=user.id).order_by(Message.timestamp.desc()).limit(limit).all()[::-1]
-    return result
 
+# Returns a page of messages between a specific user and the assistant, and the cursor of the next (older) page:
+async def get_user_messages(db: db_dependency, user: user_dependency, limit: int = 20, cursor: Optional[str] = None,
+                            include_audio: bool = False) -> Tuple[List[MessageResponse], Optional[str]]:
+    # Only selecting the columns in the response, rather than loading whole messages:
+    query = select(Message.id, Message.type, Message.text, Message.feedback, Message.audio_ref, Message.timestamp).filter(
+        Message.user_id == user.id
+    )
 
-def format_message(message: List[Message], user: user_dependency):
-    if message.type == MessageType.USER: text = f"{user.name}'s Prompt: {message.text}"
-    else: text = message.text
-    
-    return {"role": message.type.value, "content": [{"type": "text", "text": text}]}
+    # Continuing after the cursor, so that each page is a range scan of the (user_id, timestamp, id) index.
+    # The cursor's timestamp is read as stored, rather than sent back by the client, since it isn't stored in the same format
+    # on every database (SQLite stores the default timestamp without fractions of a second, and compares them as text):
+    if cursor:
+        cursor_id = decode_cursor(cursor)
+        cursor_timestamp = select(Message.timestamp).filter_by(id=cursor_id, user_id=user.id).scalar_subquery()
+        query = query.filter(tuple_(Message.timestamp, Message.id) < tuple_(cursor_timestamp, cursor_id))
 
+    # Fetching one more than needed to find out whether there is another page:
+    rows = (await db.execute(query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1))).all()
+    next_cursor = encode_cursor(rows[limit - 1].id) if len(rows) > limit else None
 
-def format_messages(messages: List[Message], user: user_dependency) -> List[str]:
-    # Need to use the string value of the enum to avoid issues with JSON serialization:
-    formatted_messages = []
+    # Newest first was needed to get the last X messages, but the oldest message should appear first:
+    messages = [MessageResponse.model_validate(row) for row in rows[:limit][::-1]]
 
-    for message in messages:
-        formatted_messages.append(format_message(message, user))
+    if include_audio:
+        # Reading the audio from the blob store only when asked, as it is much larger than the rest of the page:
+        for message in messages:
+            if message.audio_ref:
+                audio = await run_in_threadpool(lambda audio_ref: b"".join(blob_store.read(audio_ref)), message.audio_ref)
+                message.encoded_audio = base64.b64encode(audio).decode("utf-8")
 
-    return formatted_messages
+    return messages, next_cursor
 
 
-def add_message(db: db_dependency, user: user_dependency, type: MessageType, text: str, encoded_audio: Optional[str] = None) -> Message:
-    new_message = Message(user_id=user.id, type=type, text=text, encoded_audio=encoded_audio)
-    db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
+async def add_message(user: user_dependency, type: MessageType, text: str, 
+                      audio: Optional[bytes] = None, audio_format: Optional[str] = None) -> Message:
+    # Storing the audio outside the database, so that reading the history doesn't load it:
+    audio_ref = await run_in_threadpool(blob_store.put, audio, audio_format, prefix="audio") if audio else None
 
-    # Scoring the message - TODO: Local only, too memory-expensive for Render hosting:
-    # scores = keyword_extractor.score_categories(text)
-    # for category, score in scores.items():
-    #     db.add(MessageInsight(message_id=new_message.id, category=category.value, score=score))
-    # db.commit()
+    # Queuing the message to be inserted along with those of concurrent requests, which returns once it is committed
+    # (and written through to the cached history):
+    message = await message_writer.write(user.id, user.name, type, text, audio_ref)
 
-    return new_message
+    # Scoring the message in the background, if enabled, so that the response doesn't wait for it:
+    if INSIGHT_SCORING: insight_scorer.submit(message)
+    return message
 
 
-def add_message_feedback(db: db_dependency, user, message_id: int, feedback: MessageFeedback) -> None:
+async def add_message_feedback(db: db_dependency, user, message_id: int, feedback: MessageFeedback) -> None:
     # Retrieving the message from the database:
-    message = db.query(Message).filter_by(id=message_id, user_id=user.id, type=MessageType.ASSISTANT).first()
+    message = (await db.scalars(select(Message).filter_by(id=message_id, user_id=user.id, type=MessageType.ASSISTANT))).first()
 
     # Checking if the message exists:
     if not message:
@@ -88,85 +113,189 @@ def add_message_feedback(db: db_dependency, user, message_id: int, feedback: Mes
 
     # Updating the message feedback:
     message.feedback = feedback
-    db.commit()
+    await db.commit()
+    context_builder.invalidate(user.id)
+
+
+async def delete_message_batches(db: db_dependency, user_id: int, *conditions, model=Message) -> int:
+    # Deleting the user's matching messages (or archived messages) in bounded batches, each in its own transaction,
+    # without loading them. Their insights are removed by the database, through the ON DELETE CASCADE foreign key:
+    deleted = 0
+    context_builder.invalidate(user_id)
+
+    while True:
+        batch = select(model.id).filter(model.user_id == user_id, *conditions).limit(DELETE_BATCH_SIZE).scalar_subquery()
+        audio_refs = (await db.scalars(delete(model).where(model.id.in_(batch)).returning(model.audio_ref))).all()
+        await context_builder.bump_version(db, user_id)
+        await db.commit()
+
+        # Deleting the audio only once the messages referencing it are gone:
+        await run_in_threadpool(blob_store.delete_many, [audio_ref for audio_ref in audio_refs if audio_ref])
+
+        deleted += len(audio_refs)
+        if len(audio_refs) < DELETE_BATCH_SIZE: return deleted
+
+
+async def delete_messages(db: db_dependency, user: user_dependency) -> None:
+    # Clearing the history includes the messages that have been archived, along with their compressed audio:
+    conversation = [MessageType.USER, MessageType.ASSISTANT]
+    await delete_message_batches(db, user.id, Message.type.in_(conversation))
+    await delete_message_batches(db, user.id, ArchivedMessage.type.in_(conversation), model=ArchivedMessage)
+    context_builder.invalidate(user.id)
 
 
-def delete_messages(db: db_dependency, user: user_dependency) -> None:
-    messages = db.query(Message).filter((Message.user_id == user.id) & ((Message.type == MessageType.USER) | (Message.type == MessageType.ASSISTANT))).all()
-    for message in messages: db.delete(message)
-    db.commit()
+async def get_message_audio(db: db_dependency, user: user_dependency, message_id: int) -> str:
+    audio_ref = await db.scalar(select(Message.audio_ref).filter_by(id=message_id, user_id=user.id))
+    if not audio_ref: raise MessageNotFoundException(detail="The specified message has no audio.")
+    return audio_ref
 
 
-def speech_to_text(audio_bytes: bytes, file_name: str) -> str:
-    audio_file = BytesIO(audio_bytes)
-    audio_file.name = file_name
-    result = client.audio.transcriptions.create(model="whisper-1", file=audio_file).text
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # Only single ranges are supported - for anything else, the whole content is sent, which is also valid:
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header: return None
+
+    start_text, _, end_text = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # A range like "bytes=-500" requests the last 500 bytes:
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+
+    end = min(end, size - 1)
+    if start > end: raise RangeNotSatisfiableException(size)
+    return start, end
+
+
+def audio_response(audio_ref: str, range_header: Optional[str] = None) -> StreamingResponse:
+    try: size = blob_store.size(audio_ref)
+    except KeyError: raise MessageNotFoundException(detail="The specified message has no audio.")
+
+    extension = audio_ref.rsplit(".", 1)[-1]
+    headers = {"Accept-Ranges": "bytes"}
+    byte_range = parse_range(range_header, size)
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    headers["Content-Length"] = str(end - start + 1)
+
+    # The blob is read in chunks, so that the whole file is never held in memory:
+    return StreamingResponse(
+        blob_store.read(audio_ref, start, end), status_code=status_code, headers=headers,
+        media_type=AUDIO_MEDIA_TYPES.get(extension, "application/octet-stream")
+    )
+
+
+async def speech_to_text(audio_bytes: bytes, file_name: str) -> str:
+    # Passing the file as a (name, content) tuple, so that it can be sent again on a retry:
+    transcription = await upstream.call(
+        UpstreamStage.STT, upstream.openai_client.audio.transcriptions.create,
+        model="whisper-1", file=(file_name, audio_bytes)
+    )
+    result = transcription.text
     print(f"\033[1;33mConverted speech to text: {result}\033[0m")
     return result
 
 
-def neuphonic_text_to_speech(text: str) -> str:
-    # Using the Neuphonic client to generate audio from text:
-    sse = neuphonic_client.tts.SSEClient()
+async def neuphonic_audio_chunks(text: str, tts_config: TTSConfig = TTSConfig()) -> AsyncGenerator[bytes, None]:
+    # Sending the text and yielding the PCM audio from the stream of server-sent events as it arrives:
+    async with upstream.stream(
+        UpstreamStage.NEUPHONIC, "POST", f"{neuphonic_sse.http_url}/sse/speak/{tts_config.language_id}",
+        headers=neuphonic_sse.headers, json={"text": text, "model": to_dict(tts_config)}
+    ) as response:
+
+        if response.status_code != 200:
+            print(f"Neuphonic request failed with status code {response.status_code}")
+            raise APIRequestException
 
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "): continue
+            yield SSEResponse(**json.loads(line[len("data: "):])).data.audio
+
+
+async def neuphonic_text_to_speech(text: str) -> bytes:
     # Options can be set here:
     tts_config = TTSConfig()
-    
-    # Sending the text and getting the response:
-    response = sse.send(text, tts_config=tts_config)
-    
-    # Collect the audio data
-    audio_data = b''
-    for item in response:
-        audio_data += item.data.audio
-    
-    # Writing the raw audio data into a WAV file in memory:
-    wav_buffer = io.BytesIO()
-    with wave.open(wav_buffer, 'wb') as wf:
-        # Setting the parameters for the WAV file:
-        # Mono audio, 16-bit audio, 22050 Hz sampling rate:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(22050)
-        wf.writeframes(audio_data)
-    
-    # Retrieving the WAV data from the buffer:
-    wav_data = wav_buffer.getvalue()
-    
-    # Encoding the WAV data to base64:
-    encoded_audio = base64.b64encode(wav_data).decode('utf-8')
 
-    return encoded_audio
+    # Collecting the chunks in a list, so that they are only copied once when joined:
+    chunks = [chunk async for chunk in neuphonic_audio_chunks(text, tts_config)]
+    header = wav_header(sum(len(chunk) for chunk in chunks), tts_config.sampling_rate)
 
+    return b"".join([header, *chunks])
 
-def text_to_speech(text: str, voice: OpenAIVoice = OpenAIVoice.ALLOY) -> str:
-    audio_response = client.audio.speech.create(
-        model="tts-1",
-        voice=voice.value,
-        input=text
-    )
-    audio_bytes = audio_response.content
 
-    # Encoding to base64:
-    encoded_audio = base64.b64encode(audio_bytes).decode("utf-8")
+async def stream_speech(text: str) -> AsyncGenerator[bytes, None]:
+    # Sending previously synthesized audio in a single chunk:
+    cache_key = speech_cache.make_key(text, TTSModel.NEUPHONIC, None, AUDIO_FORMATS[TTSModel.NEUPHONIC])
+    cached_audio = await speech_cache.lookup(cache_key)
+
+    if cached_audio is not None:
+        async def cached_chunks() -> AsyncGenerator[bytes, None]:
+            yield cached_audio
+        return cached_chunks()
+
+    tts_config = TTSConfig()
+    chunks = neuphonic_audio_chunks(text, tts_config)
+
+    # Waiting for the first chunk before the response starts, so that upstream errors still receive an error status:
+    try: first_chunk = await chunks.__anext__()
+    except StopAsyncIteration: first_chunk = b""
+
+    async def audio_chunks() -> AsyncGenerator[bytes, None]:
+        # The header is sent first, then each chunk of PCM audio as soon as it arrives:
+        yield wav_header(STREAMING_WAV_DATA_SIZE, tts_config.sampling_rate)
+
+        collected = [first_chunk]
+        yield first_chunk
+
+        async for chunk in chunks:
+            collected.append(chunk)
+            yield chunk
+
+        # Caching the complete audio, with the correct size in its header:
+        header = wav_header(sum(len(chunk) for chunk in collected), tts_config.sampling_rate)
+        await speech_cache.store(cache_key, b"".join([header, *collected]))
+
+    return audio_chunks()
+
+
+async def text_to_speech(text: str, voice: OpenAIVoice = OpenAIVoice.ALLOY) -> bytes:
+    audio_response = await upstream.call(
+        UpstreamStage.TTS, upstream.openai_client.audio.speech.create,
+        model="tts-1", voice=voice.value, input=text, response_format=AUDIO_FORMATS[TTSModel.OPENAI]
+    )
     print(f"\033[1;32mConverted text output to speech.\033[0m")
     
-    return encoded_audio
-
+    return audio_response.content
 
-def send_completion_request(_: user_dependency, messages: dict, encoded_image: str = None, model: AIModel = AIModel.GPT_4O, max_tokens: int = 300) -> str:
 
-    if encoded_image: 
+def build_completion_payload(messages: dict, image_url: str = None, model: AIModel = AIModel.GPT_4O, max_tokens: int = 300,
+                             image_detail: ImageDetail = ImageDetail.AUTO) -> dict:
+    if image_url: 
         # If there is an image, adding it to the user's last message (all past images excluded due to context window limits):
         # There will always be a content field due to the formatting method.
-        messages[-1]["content"].append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"}})
-        
+        messages[-1]["content"].append({"type": "image_url", "image_url": {"url": image_url, "detail": image_detail.value}})
+
+    return {"model": model.value, "messages": messages, "max_tokens": max_tokens}
+
+
+async def send_completion_request(_: user_dependency, messages: dict, image_url: str = None, model: AIModel = AIModel.GPT_4O, max_tokens: int = 300,
+                                  image_detail: ImageDetail = ImageDetail.AUTO) -> str:
     headers = {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"}
-    payload = {"model": model.value, "messages": messages, "max_tokens": max_tokens}
+    payload = build_completion_payload(messages, image_url, model, max_tokens, image_detail)
 
     # Sending the completion request:
     print(f"\033[1;32mSent completion request.\033[0m")
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+    response = await upstream.request(UpstreamStage.COMPLETION, "POST", COMPLETIONS_URL, headers=headers, json=payload)
     print(f"\033[1;32mReceived completion response.\033[0m")
 
     # Checking if the response is successful:
@@ -178,7 +307,7 @@ def send_completion_request(_: user_dependency, messages: dict, encoded_image: s
     # Extracting the response content:
     response_data = response.json()
 
-    # Need to obtain values from dict (rather than attributes) since we are using requests instead of SDK:
+    # Need to obtain values from dict (rather than attributes) since we are not using the SDK:
     response_message = response_data["choices"][0]["message"]
 
     response_text = response_message["content"]
@@ -186,72 +315,228 @@ def send_completion_request(_: user_dependency, messages: dict, encoded_image: s
     return response_text
 
 
-async def completion(db: db_dependency, user: user_dependency, text: Optional[str], audio: Optional[UploadFile], 
-                     image: Optional[UploadFile], encoded_image: Optional[str] = None, model: AIModel = AIModel.GPT_4O, 
-                     generate_audio: bool = False, tts_model: TTSModel = TTSModel.OPENAI, openai_voice: OpenAIVoice = OpenAIVoice.ALLOY, 
-                     max_tokens: int = 300, context_message_count: int = 20) -> dict:
+async def stream_completion_request(messages: dict, image_url: str = None, model: AIModel = AIModel.GPT_4O, 
+                                    max_tokens: int = 300, image_detail: ImageDetail = ImageDetail.AUTO) -> AsyncGenerator[str, None]:
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {OPENAI_API_KEY}"}
+    payload = build_completion_payload(messages, image_url, model, max_tokens, image_detail)
+    payload["stream"] = True
 
-    try:
-        # Updating the user's insights - TODO: Local only, too memory-expensive for Render hosting:
-        # update_user_insights(db, user)
-
-        # If at least one type of input is not provided, raising an exception:
-        if not any([text, audio, image, encoded_image]):
-            raise NoMessageException
-
-        transcription = None
-        if audio:
-            # Reading the audio and converting to text:
-            audio_bytes = await audio.read()
-            transcription = await run_in_threadpool(
-                speech_to_text, audio_bytes, audio.filename
-            )
-            await audio.close()
+    print(f"\033[1;32mSent streaming completion request.\033[0m")
+    async with upstream.stream(UpstreamStage.COMPLETION, "POST", COMPLETIONS_URL, headers=headers, json=payload) as response:
+
+        if response.status_code != 200:
+            print(f"API request failed with status code {response.status_code}")
+            print(f"Response content: {(await response.aread()).decode(errors='replace')}")
+            raise APIRequestException
+
+        # The API sends one server-sent event per line, each holding a chunk of the response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "): continue
+
+            data = line[len("data: "):]
+            if data == "[DONE]": break
+
+            choices = json.loads(data)["choices"]
+            delta = choices[0]["delta"].get("content") if choices else None
+            if delta: yield delta
+
+    print(f"\033[1;32mReceived streamed completion response.\033[0m")
+
+
+async def generate_speech(text: str, tts_model: TTSModel = TTSModel.OPENAI, openai_voice: OpenAIVoice = OpenAIVoice.ALLOY) -> bytes:
+    # Returning previously synthesized audio for the same text and voice without calling the TTS model:
+    cache_key = speech_cache.make_key(text, tts_model, openai_voice, AUDIO_FORMATS[tts_model])
+    audio_bytes = await speech_cache.lookup(cache_key)
 
+    if audio_bytes is None:
+        # Determining which TTS function to use based on tts_model:
+        if tts_model == TTSModel.OPENAI:
+            audio_bytes = await text_to_speech(text, openai_voice)
+        elif tts_model == TTSModel.NEUPHONIC:
+            audio_bytes = await neuphonic_text_to_speech(text)
+
+        await speech_cache.store(cache_key, audio_bytes)
+
+    return audio_bytes
+
+
+def message_response(message: Message, audio: Optional[bytes] = None) -> MessageResponse:
+    # Including the audio of a new message, so that it can be played without another request:
+    encoded_audio = base64.b64encode(audio).decode("utf-8") if audio else None
+    return MessageResponse.model_validate(message).model_copy(update={"encoded_audio": encoded_audio})
+
+
+async def prepare_image(image_content: Optional[bytes], image_detail: ImageDetail = ImageDetail.AUTO) -> Optional[str]:
+    if not image_content: return None
+
+    # Reducing the image to what the model can use, then encoding it as a data URL:
+    image_bytes, mime_type = await image_processing.process_image(image_content, image_detail)
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+async def prepare_completion(user: user_dependency, text: Optional[str], audio: Optional[UploadFile], 
+                             image: Optional[UploadFile], encoded_image: Optional[str] = None, model: AIModel = AIModel.GPT_4O, 
+                             max_tokens: int = 300, context_message_count: Optional[int] = None, 
+                             image_detail: ImageDetail = ImageDetail.AUTO) -> Tuple[List[dict], Optional[str], Optional[str]]:
+    # Updating the user's insights - TODO: Local only, too memory-expensive for Render hosting:
+    # update_user_insights(db, user)
+
+    # If at least one type of input is not provided, raising an exception:
+    if not any([text, audio, image, encoded_image]):
+        raise NoMessageException
+
+    user_id, user_name, history_version = user.id, user.name, user.history_version
+    has_image = bool(image or encoded_image)
+
+    async def transcribe() -> Optional[str]:
+        if not audio: return None
+
+        # Reading the audio and converting to text:
+        audio_bytes = await audio.read()
+        await audio.close()
+        return await speech_to_text(audio_bytes, audio.filename)
+
+    async def read_image() -> Optional[bytes]:
         if image and not encoded_image:
-            # Reading and encoding the image file:
+            # Reading the image file:
             image_content = await image.read()
-            encoded_image = base64.b64encode(image_content).decode("utf-8")
             await image.close()
+            return image_content
 
+        if encoded_image:
+            # Decoding the image, so that it can be processed and the cache key depends on its content.
+            # Invalid characters are rejected rather than skipped, so a corrupt image isn't silently dropped:
+            try: image_content = base64.b64decode(encoded_image, validate=True)
+            except binascii.Error as e: raise UnprocessableMessageException from e
+
+            if not image_content: raise UnprocessableMessageException
+            return image_content
+
+        return None
+
+    async def build_system_prompt() -> str:
+        # The user's insights are loaded with the user, so this doesn't query the DB:
+        return get_dynamic_prompt(user)
+
+    async def build_user_text(transcription: Optional[str]) -> str:
         # Concatenating user's text and audio prompt:
-        user_text = f"{text or ''} {transcription or ''}".strip()
+        return f"{text or ''} {transcription or ''}".strip()
 
+    async def load_history() -> Optional[context_builder.UserHistory]:
+        # Requests with an image are sent without the conversation so far, so it isn't needed:
+        if has_image: return None
+        return await context_builder.load_history(user_id, user_name, history_version)
+
+    async def build_cache_key(image_content: Optional[bytes], user_text: str, system_prompt: str) -> Optional[str]:
+        # Only requests with an image are cached, since text-only requests depend on the conversation so far:
+        if not image_content: return None
+        return completion_cache.make_key(image_content, user_text, model, system_prompt, max_tokens, image_detail)
+
+    async def insert_user_message(user_text: str) -> Optional[Message]:
         # Adding the user's message to the DB:
-        if user_text:
-            await run_in_threadpool(add_message, db, user, MessageType.USER, user_text)
+        if not user_text: return None
+        return await add_message(user, MessageType.USER, user_text)
+
+    async def build_messages(history: Optional[context_builder.UserHistory], user_text: str, system_prompt: str, 
+                             user_message: Optional[Message]) -> List[dict]:
+        # Without any text, an empty user message is still needed to attach the image to:
+        if history is None: return context_builder.build_image_context(system_prompt, user_text)
+
+        # The history may have been read before the user's message was added, so it is passed separately:
+        new_message = user_message or Message(type=MessageType.USER, text=user_text)
+        return context_builder.build_context(history, system_prompt, new_message, user_name, model, context_message_count)
+
+    # Transcription, reading the history and processing the image don't depend on each other, so they run concurrently.
+    # The image is processed even if the response turns out to be cached, as waiting for the transcription would delay every miss:
+    graph = StageGraph("completion")
+    graph.add("transcription", transcribe)
+    graph.add("image", read_image)
+    graph.add("system_prompt", build_system_prompt)
+    graph.add("history", load_history)
+    graph.add("image_url", lambda image_content: prepare_image(image_content, image_detail), "image")
+    graph.add("user_text", build_user_text, "transcription")
+    graph.add("cache_key", build_cache_key, "image", "user_text", "system_prompt")
+    graph.add("user_message", insert_user_message, "user_text")
+    graph.add("messages", build_messages, "history", "user_text", "system_prompt", "user_message")
+
+    results = await graph.run()
+    return results["messages"], results["image_url"], results["cache_key"]
+
+
+async def request_completion(user: user_dependency, messages: List[dict], image_url: Optional[str] = None, 
+                             model: AIModel = AIModel.GPT_4O, max_tokens: int = 300, cache_key: Optional[str] = None,
+                             image_detail: ImageDetail = ImageDetail.AUTO) -> str:
+    # Skipping the upstream call completely if the same request has been answered before:
+    if cache_key:
+        cached_text = await completion_cache.lookup(cache_key)
+        if cached_text is not None: return cached_text
+
+    completion_text = await send_completion_request(user, messages, image_url, model, max_tokens, image_detail)
+
+    if cache_key: await completion_cache.store(cache_key, completion_text)
+    return completion_text
 
-        # Getting all the messages associated with the user:
-        messages = await run_in_threadpool(get_messages, db, user, context_message_count)
 
-        # User message object needed to attach image:
-        if not user_text:
-            messages.append(format_message(Message(type=MessageType.USER, text=user_text), user))
+async def completion_chunks(messages: List[dict], image_url: Optional[str] = None, model: AIModel = AIModel.GPT_4O, 
+                            max_tokens: int = 300, cache_key: Optional[str] = None, 
+                            image_detail: ImageDetail = ImageDetail.AUTO) -> AsyncGenerator[str, None]:
+    cached_text = await completion_cache.lookup(cache_key) if cache_key else None
 
-        # Sending the completion request:
-        completion_text = await run_in_threadpool(
-            send_completion_request,
-            user, messages, encoded_image, model, max_tokens,
+    if cached_text is not None:
+        # A cached response is sent as a single chunk:
+        yield cached_text
+        return
+
+    chunks = []
+    async for chunk in stream_completion_request(messages, image_url, model, max_tokens, image_detail):
+        chunks.append(chunk)
+        yield chunk
+
+    if cache_key: await completion_cache.store(cache_key, "".join(chunks))
+
+
+def speak_completion(chunks: AsyncGenerator[str, None], tts_model: TTSModel = TTSModel.OPENAI, 
+                     openai_voice: OpenAIVoice = OpenAIVoice.ALLOY) -> AsyncGenerator[Tuple[str, object], None]:
+    # Synthesizing each sentence while the rest of the completion is still arriving:
+    return pipeline_speech(chunks, lambda sentence: generate_speech(sentence, tts_model, openai_voice))
+
+
+def format_event(event: str, data: dict) -> str:
+    # Server-sent events are separated by a blank line:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def completion(user: user_dependency, text: Optional[str], audio: Optional[UploadFile], 
+                     image: Optional[UploadFile], encoded_image: Optional[str] = None, model: AIModel = AIModel.GPT_4O, 
+                     generate_audio: bool = False, tts_model: TTSModel = TTSModel.OPENAI, openai_voice: OpenAIVoice = OpenAIVoice.ALLOY, 
+                     max_tokens: int = 300, context_message_count: Optional[int] = None, image_detail: ImageDetail = ImageDetail.AUTO) -> dict:
+
+    try:
+        messages, image_url, cache_key = await prepare_completion(
+            user, text, audio, image, encoded_image, model, max_tokens, context_message_count, image_detail
         )
 
-        encoded_audio = None
+        # The user message was committed while preparing, so no connection is held during the upstream requests below:
+        audio = None
         if generate_audio:
-            # Determining which TTS function to use based on tts_model:
-            if tts_model == TTSModel.OPENAI:
-                encoded_audio = await run_in_threadpool(
-                    text_to_speech, completion_text, openai_voice
-                )
-            elif tts_model == TTSModel.NEUPHONIC:
-                encoded_audio = await run_in_threadpool(
-                    neuphonic_text_to_speech, completion_text
-                )
-            
+            # Streaming the completion, so that the speech of each sentence can be generated before the rest has arrived:
+            text_chunks, audio_segments = [], []
+            chunks = completion_chunks(messages, image_url, model, max_tokens, cache_key, image_detail)
+            async for kind, value in speak_completion(chunks, tts_model, openai_voice):
+                if kind == TEXT: text_chunks.append(value)
+                else: audio_segments.append(value)
+
+            completion_text = "".join(text_chunks)
+            audio = stitch_audio(audio_segments, AUDIO_FORMATS[tts_model])
+
+        else:
+            # Sending the completion request:
+            completion_text = await request_completion(user, messages, image_url, model, max_tokens, cache_key, image_detail)
+
         # Adding the assistant response to the DB:
-        assistant_message = await run_in_threadpool(
-            add_message, db, user, MessageType.ASSISTANT, completion_text, encoded_audio
-        )
+        assistant_message = await add_message(user, MessageType.ASSISTANT, completion_text, audio, AUDIO_FORMATS[tts_model])
 
-        return assistant_message
+        return message_response(assistant_message, audio)
 
     except HTTPException as h:
         # Raising HTTP Exceptions again without modification:
@@ -262,6 +547,66 @@ async def completion(db: db_dependency, user: user_dependency, text: Optional[st
         raise UnprocessableMessageException from e
 
 
+async def stream_completion(user: user_dependency, text: Optional[str], audio: Optional[UploadFile], 
+                            image: Optional[UploadFile], encoded_image: Optional[str] = None, model: AIModel = AIModel.GPT_4O, 
+                            generate_audio: bool = False, tts_model: TTSModel = TTSModel.OPENAI, openai_voice: OpenAIVoice = OpenAIVoice.ALLOY, 
+                            max_tokens: int = 300, context_message_count: Optional[int] = None, 
+                            image_detail: ImageDetail = ImageDetail.AUTO) -> AsyncGenerator[str, None]:
+
+    # Preparing the input before streaming starts, so that invalid requests still receive an error status:
+    try:
+        messages, image_url, cache_key = await prepare_completion(
+            user, text, audio, image, encoded_image, model, max_tokens, context_message_count, image_detail
+        )
+
+    except HTTPException as h:
+        raise h
+
+    except Exception as e:
+        print(f"Error during completion: {e}")
+        raise UnprocessableMessageException from e
+
+    async def events() -> AsyncGenerator[str, None]:
+        try:
+            chunks = completion_chunks(messages, image_url, model, max_tokens, cache_key, image_detail)
+            text_chunks, audio_segments = [], []
+
+            if generate_audio:
+                # Sending the speech of each sentence in order, while later tokens are still arriving:
+                audio_format = AUDIO_FORMATS[tts_model]
+                async for kind, value in speak_completion(chunks, tts_model, openai_voice):
+                    if kind == TEXT:
+                        text_chunks.append(value)
+                        yield format_event("token", {"text": value})
+                    else:
+                        yield format_event("audio", {
+                            "index": len(audio_segments), "format": audio_format, "audio": base64.b64encode(value).decode("utf-8")
+                        })
+                        audio_segments.append(value)
+
+            else:
+                # Forwarding each chunk of the response to the client as soon as it arrives:
+                async for chunk in chunks:
+                    text_chunks.append(chunk)
+                    yield format_event("token", {"text": chunk})
+
+            completion_text = "".join(text_chunks)
+            audio = stitch_audio(audio_segments, AUDIO_FORMATS[tts_model])
+
+            # The message writer uses its own sessions, so this works after the request has returned:
+            assistant_message = await add_message(user, MessageType.ASSISTANT, completion_text, audio, AUDIO_FORMATS[tts_model])
+
+            # The audio has already been sent in segments, so the message only refers to the stitched audio:
+            yield format_event("message", message_response(assistant_message).model_dump(mode="json"))
+
+        except Exception as e:
+            # The status code has already been sent, so errors are reported as an event:
+            print(f"Error during streamed completion: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else UnprocessableMessageException().detail
+            yield format_event("error", {"detail": detail})
+
+    return events()
+
 # def update_user_insights(db: db_dependency, user: user_dependency):
 #     # Predicting user preferences:
 #     preferences = predict_preferences(db, user.id)
@@ -1,22 +1,26 @@
+from sqlalchemy import select
+
 from ..exceptions import UserNotFoundException, InvalidCredentialsException
 from ..dependencies import db_dependency, auth_dependency
 from ..models import User
-from ..security import bcrypt_context, create_access_token
+from ..security import create_access_token
+from .password_hashing import verify_password
 
 
-def authenticate_user(db: db_dependency, email: str, password: str) -> User:
+async def authenticate_user(db: db_dependency, email: str, password: str) -> User:
     # Searching for a user with the given email in lowercase:
-    user = db.query(User).filter_by(email=email.lower()).first()
+    user = (await db.execute(select(User).filter_by(email=email.lower()))).scalar_one_or_none()
 
     if user is None: raise UserNotFoundException
-    elif not bcrypt_context.verify(password, user.password): raise InvalidCredentialsException
+    # Hashing is slow by design, so it runs in the password hashing workers:
+    elif not await verify_password(password, user.password): raise InvalidCredentialsException
     return user
 
 
-def login_and_generate_token(db: db_dependency, auth_form: auth_dependency) -> dict:
+async def login_and_generate_token(db: db_dependency, auth_form: auth_dependency) -> dict:
     # auth_form is of type OAuth2PasswordRequestForm, so it has attributes username and password.
     # In this case, username represents the user's email:
-    user = authenticate_user(db, auth_form.username, auth_form.password)
+    user = await authenticate_user(db, auth_form.username, auth_form.password)
 
     token = create_access_token(user.id)
 
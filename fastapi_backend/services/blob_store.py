@@ -0,0 +1,85 @@
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, Optional
+
+
+# Size of the chunks that blobs are streamed in:
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobStore(ABC):
+    # Stores binary content outside the database, referenced by the key returned from put:
+
+    @abstractmethod
+    def put(self, data: bytes, extension: str, prefix: str = "") -> str: ...
+
+    @abstractmethod
+    def size(self, key: str) -> int: ...
+
+    @abstractmethod
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        # Yields the bytes from start up to and including end, or to the end of the blob if end is None.
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        for key in keys: self.delete(key)
+
+
+class LocalBlobStore(BlobStore):
+
+    def __init__(self, root: str):
+        self.root = root
+
+
+    def _path(self, key: str) -> str:
+        # Keys are generated by put, but checking anyway that they can't point outside the root:
+        path = os.path.realpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.realpath(self.root) + os.sep): raise KeyError(key)
+        return path
+
+
+    def put(self, data: bytes, extension: str, prefix: str = "") -> str:
+        # Keys are unique per blob, so deleting one never affects another:
+        name = uuid.uuid4().hex
+        key = os.path.join(prefix, name[:2], f"{name}.{extension}")
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Writing to a temporary file first, so that readers never see a partially written blob:
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+        return key
+
+
+    def size(self, key: str) -> int:
+        try: return os.path.getsize(self._path(key))
+        except FileNotFoundError: raise KeyError(key)
+
+
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk: break
+                if remaining is not None: remaining -= len(chunk)
+                yield chunk
+
+
+    def delete(self, key: str) -> None:
+        try: os.remove(self._path(key))
+        except FileNotFoundError: pass
+
+
+# The store used for message audio - by default next to the package, wherever the application is started from:
+blob_store: BlobStore = LocalBlobStore(os.getenv("BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "blobs")))
@@ -0,0 +1,170 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def content_hash(*parts: Any) -> str:
+    # Hashing each part with a separator, so that different splits of the same content don't collide:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class TTLCache:
+    # Thread-safe in-memory cache, evicting the least recently used entry once full:
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+
+            value, expiry = entry
+            if expiry is not None and expiry < time.monotonic():
+                del self._entries[key]
+                return None
+
+            # Marking the entry as the most recently used:
+            self._entries.move_to_end(key)
+            return value
+
+
+    def set(self, key: str, value: Any) -> None:
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+
+        with self._lock:
+            self._entries[key] = (value, expiry)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskStore:
+    # Size-bounded on-disk store, with an in-memory index used to evict the least recently used files:
+
+    def __init__(self, directory: str, max_bytes: int, ttl: Optional[float] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+
+        # Maps each key to the size of its file, ordered from least to most recently used:
+        self._index: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+
+    def _load_index(self) -> None:
+        # Rebuilding the index from the files left by previous runs, oldest first:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total_bytes += size
+
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+
+        try:
+            if self.ttl is not None and os.path.getmtime(path) + self.ttl < time.time():
+                self.delete(key)
+                return None
+
+            with open(path, "rb") as f:
+                data = f.read()
+
+        except FileNotFoundError:
+            # The file may have been evicted by another worker sharing the directory:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None: self.total_bytes -= size
+            return None
+
+        with self._lock:
+            if key in self._index: self._index.move_to_end(key)
+
+        return data
+
+
+    def set(self, key: str, data: bytes) -> None:
+        # Anything larger than the whole store would only evict everything else:
+        if len(data) > self.max_bytes: return
+
+        # Writing to a temporary file first, so that readers never see a partially written file:
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+        with self._lock:
+            self.total_bytes += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            evicted = self._evict()
+
+        for evicted_key in evicted:
+            self._remove_file(evicted_key)
+
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is not None: self.total_bytes -= size
+
+        self._remove_file(key)
+
+
+    def _evict(self) -> list:
+        # Must be called while holding the lock - the files are removed afterwards:
+        evicted = []
+        while self.total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.total_bytes -= size
+            evicted.append(key)
+        return evicted
+
+
+    def _remove_file(self, key: str) -> None:
+        try: os.remove(self._path(key))
+        except FileNotFoundError: pass
+
+
+    def __len__(self) -> int:
+        return len(self._index)
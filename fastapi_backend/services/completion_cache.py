@@ -0,0 +1,73 @@
+import os
+import json
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .. import metrics
+from ..enums import AIModel, ImageDetail
+from .cache import TTLCache, DiskStore, content_hash
+
+
+# In-memory tier, bounded by entry count and expiring after the TTL:
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", 512))
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", 3600))
+
+# Optional on-disk tier, shared by all workers using the same directory:
+COMPLETION_CACHE_DIR = os.getenv("COMPLETION_CACHE_DIR")
+COMPLETION_CACHE_MAX_BYTES = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+_memory = TTLCache(COMPLETION_CACHE_SIZE, COMPLETION_CACHE_TTL)
+_disk = DiskStore(COMPLETION_CACHE_DIR, COMPLETION_CACHE_MAX_BYTES, COMPLETION_CACHE_TTL) if COMPLETION_CACHE_DIR else None
+
+
+def make_key(image_bytes: bytes, text: str, model: AIModel, system_prompt: str, max_tokens: int,
+             image_detail: ImageDetail = ImageDetail.AUTO) -> str:
+    # Normalizing the text, so that differences in case and spacing still hit the same entry:
+    normalized_text = " ".join(text.lower().split())
+
+    # Requests with an image are sent without the user's name or conversation, so entries are shared by every user
+    # with the same preferences. Only a fingerprint of the prompt is needed, since it changes with the user's preferences:
+    return content_hash(content_hash(image_bytes), normalized_text, model.value, content_hash(system_prompt), max_tokens, image_detail.value)
+
+
+async def lookup(key: str) -> Optional[str]:
+    completion_text = _memory.get(key)
+    if completion_text is not None:
+        metrics.increment("completion_cache.memory_hits")
+        return completion_text
+
+    if _disk is not None:
+        data = await run_in_threadpool(_disk.get, key)
+        if data is not None:
+            metrics.increment("completion_cache.disk_hits")
+
+            # Promoting the entry to the in-memory tier:
+            completion_text = json.loads(data)["text"]
+            _memory.set(key, completion_text)
+            return completion_text
+
+    metrics.increment("completion_cache.misses")
+    return None
+
+
+async def store(key: str, completion_text: str) -> None:
+    _memory.set(key, completion_text)
+
+    if _disk is not None:
+        await run_in_threadpool(_disk.set, key, json.dumps({"text": completion_text}).encode("utf-8"))
+
+
+def cache_stats() -> dict:
+    hits = metrics.get_counter("completion_cache.memory_hits") + metrics.get_counter("completion_cache.disk_hits")
+    lookups = hits + metrics.get_counter("completion_cache.misses")
+
+    return {
+        "memory_entries": len(_memory),
+        "disk_entries": len(_disk) if _disk is not None else None,
+        "disk_bytes": _disk.total_bytes if _disk is not None else None,
+        "hit_ratio": hits / lookups if lookups else None,
+    }
+
+
+metrics.register_gauge("completion_cache", cache_stats)
@@ -0,0 +1,287 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from .. import metrics
+from ..database import AsyncSessionLocal
+from ..models import Message, User
+from ..enums import AIModel, MessageType
+
+
+# The most tokens of conversation (including the system prompt) sent with each request, per model:
+CONTEXT_TOKEN_BUDGETS = {
+    AIModel.GPT_4O: int(os.getenv("GPT_4O_CONTEXT_TOKENS", 4000)),
+    AIModel.GPT_4O_MINI: int(os.getenv("GPT_4O_MINI_CONTEXT_TOKENS", 4000)),
+}
+
+# Size of each user's ring buffer - the most messages kept or loaded for a user, in case they are all very short:
+MAX_CONTEXT_MESSAGES = int(os.getenv("MAX_CONTEXT_MESSAGES", 100))
+HISTORY_BATCH_SIZE = 25
+
+# Each message costs a few tokens on top of its text, for the role and separators:
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# The histories of recently active users are kept in memory, up to this many users and roughly this many bytes in total:
+CONTEXT_CACHE_USERS = int(os.getenv("CONTEXT_CACHE_USERS", 1000))
+CONTEXT_CACHE_MAX_BYTES = int(os.getenv("CONTEXT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Rough memory used by each cached message on top of its text, for the formatted dict and entry:
+ENTRY_OVERHEAD_BYTES = 400
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    # The tokenizer is optional - without it, or if its vocabulary can't be loaded, tokens are estimated from the length:
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"\033[1;31mTokenizer unavailable, estimating token counts: {e}\033[0m")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None: return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=256)
+def count_prompt_tokens(system_prompt: str) -> int:
+    # The system prompt only changes with the user's insights, so its count is reused:
+    return count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+
+
+def format_message(message: Message, user_name: str) -> dict:
+    if message.type == MessageType.USER: text = f"{user_name}'s Prompt: {message.text}"
+    else: text = message.text
+
+    return {"role": message.type.value, "content": [{"type": "text", "text": text}]}
+
+
+@dataclass(frozen=True)
+class HistoryEntry:
+    message_id: int
+    formatted: dict
+    tokens: int
+
+
+@dataclass(frozen=True)
+class UserHistory:
+    # A ring buffer of the newest messages of a user, oldest first, formatted and token-counted.
+    # The version is the user's history_version the entries correspond to:
+    user_name: str
+    version: int
+    entries: Tuple[HistoryEntry, ...] = field(default_factory=tuple)
+
+    @property
+    def size(self) -> int:
+        return sum(len(entry.formatted["content"][0]["text"]) + ENTRY_OVERHEAD_BYTES for entry in self.entries)
+
+
+class HistoryCache:
+    # Least recently used histories are evicted once there are too many users or they take up too much memory.
+    # Only used from the event loop, so no locking is needed:
+
+    def __init__(self, max_users: int, max_bytes: int):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # Each entry is the history and its size when it was added:
+        self._entries: OrderedDict = OrderedDict()
+
+
+    def get(self, user_id: int) -> Optional[UserHistory]:
+        entry = self._entries.get(user_id)
+        if entry is None: return None
+
+        self._entries.move_to_end(user_id)
+        return entry[0]
+
+
+    def set(self, user_id: int, history: UserHistory) -> None:
+        self.delete(user_id)
+
+        size = history.size
+        if size > self.max_bytes: return
+
+        self._entries[user_id] = (history, size)
+        self.total_bytes += size
+
+        while len(self._entries) > self.max_users or self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            metrics.increment("context_cache.evictions")
+
+
+    def delete(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id, None)
+        if entry is not None: self.total_bytes -= entry[1]
+
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_histories = HistoryCache(CONTEXT_CACHE_USERS, CONTEXT_CACHE_MAX_BYTES)
+
+
+def make_entry(message: Message, user_name: str) -> HistoryEntry:
+    formatted = format_message(message, user_name)
+    return HistoryEntry(message.id, formatted, count_tokens(formatted["content"][0]["text"]) + MESSAGE_OVERHEAD_TOKENS)
+
+
+def trim(entries: List[HistoryEntry]) -> Tuple[HistoryEntry, ...]:
+    # Keeping only as many of the newest messages as the largest budget could use:
+    max_tokens, total = max(CONTEXT_TOKEN_BUDGETS.values()), 0
+
+    for index in range(len(entries) - 1, -1, -1):
+        total += entries[index].tokens
+        if total > max_tokens or len(entries) - index > MAX_CONTEXT_MESSAGES: return tuple(entries[index + 1:])
+
+    return tuple(entries)
+
+
+async def load_messages(db, user_id: int, user_name: str) -> List[HistoryEntry]:
+    # Reading batches of messages, newest first, until the largest budget is filled:
+    max_tokens, total = max(CONTEXT_TOKEN_BUDGETS.values()), 0
+    entries, before_id = [], None
+
+    while total < max_tokens and len(entries) < MAX_CONTEXT_MESSAGES:
+        query = select(Message).filter_by(user_id=user_id)
+        if before_id is not None: query = query.filter(Message.id < before_id)
+        messages = (await db.scalars(query.order_by(Message.id.desc()).limit(HISTORY_BATCH_SIZE))).all()
+
+        for message in messages:
+            entry = make_entry(message, user_name)
+            entries.append(entry)
+            total += entry.tokens
+
+        if len(messages) < HISTORY_BATCH_SIZE: break
+        before_id = messages[-1].id
+
+    return entries[::-1]
+
+
+async def load_history(user_id: int, user_name: str, known_version: Optional[int] = None) -> UserHistory:
+    # The cached history is used without querying the DB if it is at least as new as the version the caller knows of,
+    # which is known when the user was loaded at the start of the request, rather than taken from the principal cache:
+    cached = _histories.get(user_id)
+    if cached is not None and cached.user_name != user_name: cached = None
+
+    if cached is not None and known_version is not None and cached.version >= known_version:
+        metrics.increment("context_cache.hits")
+        return cached
+
+    # Using a separate session, so that the history can be read while the request's session is in use:
+    async with AsyncSessionLocal() as db:
+        # Reading the version before the messages, so that a message added in between makes the history look older
+        # (and reloaded next time) rather than newer:
+        version = await db.scalar(select(User.history_version).filter_by(id=user_id)) or 0
+
+        if cached is not None and cached.version >= version:
+            metrics.increment("context_cache.hits")
+            return cached
+
+        metrics.increment("context_cache.misses")
+        history = UserHistory(user_name, version, tuple(await load_messages(db, user_id, user_name)))
+
+    _histories.set(user_id, history)
+    return history
+
+
+async def bump_version(db, user_id: int) -> int:
+    # Called in the same transaction as every change to a user's messages, so that every worker can tell its copy is stale:
+    return await db.scalar(
+        update(User).where(User.id == user_id).values(history_version=User.history_version + 1).returning(User.history_version)
+    )
+
+
+def record_message(user_id: int, user_name: str, message: Message, version: int) -> None:
+    # Writing the new message through to the cached history, so that the next request doesn't need to load it:
+    cached = _histories.get(user_id)
+    if cached is None or cached.user_name != user_name: return
+
+    if cached.version != version - 1:
+        # If the history was loaded after the message was added, it is already there.
+        # Otherwise, another worker has changed the history since, so it is loaded again next time:
+        if cached.version < version: _histories.delete(user_id)
+        return
+
+    # The messages may have been read after the message was committed, even though the version was read before it,
+    # in which case the history is already up to date:
+    if cached.entries and cached.entries[-1].message_id >= message.id:
+        _histories.set(user_id, UserHistory(user_name, version, cached.entries))
+        return
+
+    _histories.set(user_id, UserHistory(user_name, version, trim(list(cached.entries) + [make_entry(message, user_name)])))
+
+
+def invalidate(user_id: int) -> None:
+    _histories.delete(user_id)
+
+
+def build_context(history: UserHistory, system_prompt: str, new_message: Optional[Message], user_name: str,
+                  model: AIModel = AIModel.GPT_4O, max_messages: Optional[int] = None) -> List[dict]:
+    # The system prompt and the new message are always sent, and the rest of the budget is filled with the newest history:
+    new_entry = make_entry(new_message, user_name) if new_message else None
+    budget = CONTEXT_TOKEN_BUDGETS[model] - count_prompt_tokens(system_prompt) - (new_entry.tokens if new_entry else 0)
+
+    # The history may have been read after the new message was added, in which case it is already the last entry:
+    entries = history.entries
+    if new_message is not None and new_message.id is not None:
+        entries = [entry for entry in entries if entry.message_id < new_message.id]
+
+    selected, tokens = [], 0
+    for entry in reversed(entries):
+        if tokens + entry.tokens > budget or (max_messages is not None and len(selected) + 1 >= max_messages): break
+        selected.append(entry.formatted)
+        tokens += entry.tokens
+    selected.reverse()
+
+    total_tokens = count_prompt_tokens(system_prompt) + tokens + (new_entry.tokens if new_entry else 0)
+    metrics.observe("context.tokens", total_tokens)
+    metrics.observe("context.messages", len(selected))
+
+    # Copying the content lists, since the image is appended to the last message when the payload is built:
+    messages = [{"role": MessageType.SYSTEM.value, "content": [{"type": "text", "text": system_prompt}]}]
+    messages += [{"role": entry["role"], "content": list(entry["content"])} for entry in selected]
+    if new_entry: messages.append({"role": new_entry.formatted["role"], "content": list(new_entry.formatted["content"])})
+
+    return messages
+
+
+def build_image_context(system_prompt: str, text: str) -> List[dict]:
+    # Requests with an image are described on their own, without the user's name or conversation,
+    # so that the answer only depends on the image, the text and the prompt, and can be cached for every user:
+    metrics.observe("context.tokens", count_prompt_tokens(system_prompt) + count_tokens(text) + MESSAGE_OVERHEAD_TOKENS)
+    metrics.observe("context.messages", 0)
+
+    return [
+        {"role": MessageType.SYSTEM.value, "content": [{"type": "text", "text": system_prompt}]},
+        {"role": MessageType.USER.value, "content": [{"type": "text", "text": text}]},
+    ]
+
+
+def cache_stats() -> dict:
+    hits = metrics.get_counter("context_cache.hits")
+    lookups = hits + metrics.get_counter("context_cache.misses")
+
+    return {
+        "users": len(_histories),
+        "bytes": _histories.total_bytes,
+        "max_bytes": CONTEXT_CACHE_MAX_BYTES,
+        "hit_ratio": hits / lookups if lookups else None,
+    }
+
+
+metrics.register_gauge("context_cache", cache_stats)
@@ -0,0 +1,120 @@
+import io
+import os
+import math
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+from .. import metrics
+from ..enums import ImageDetail
+from .process_pool import ProcessPool
+
+
+# Format and quality of the re-encoded images - WEBP is smaller, but JPEG is supported everywhere:
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+# How the vision models see images - low detail is a single 512px image,
+# while high detail is fitted within 2048px, has its shortest side reduced to 768px, and is split into 512px tiles:
+TILE_SIZE = 512
+LOW_DETAIL_MAX_SIDE = 512
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+BASE_TOKENS = 85
+TOKENS_PER_TILE = 170
+
+# An image slightly over a tile boundary is shrunk to fit, if it loses at most this fraction of its size:
+TILE_SLACK = float(os.getenv("IMAGE_TILE_SLACK", 0.1))
+
+
+def count_tiles(width: int, height: int, detail: ImageDetail) -> int:
+    if detail == ImageDetail.LOW: return 0
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def estimate_tokens(width: int, height: int, detail: ImageDetail) -> int:
+    return BASE_TOKENS + TOKENS_PER_TILE * count_tiles(width, height, detail)
+
+
+def target_size(width: int, height: int, detail: ImageDetail) -> Tuple[int, int]:
+    # Finding the size the model would reduce the image to anyway, so that the extra pixels aren't uploaded:
+    if detail == ImageDetail.LOW:
+        scale = min(1.0, LOW_DETAIL_MAX_SIDE / max(width, height))
+    else:
+        # Automatic detail is treated as high detail, since that is the most the model may use:
+        scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+        short_side = min(width, height) * scale
+        if short_side > HIGH_DETAIL_SHORT_SIDE: scale *= HIGH_DETAIL_SHORT_SIDE / short_side
+
+        # Shrinking a little further where a side only just crosses a tile boundary, to save a row or column of tiles:
+        for side in (width, height):
+            scaled_side = side * scale
+            boundary = math.floor(scaled_side / TILE_SIZE) * TILE_SIZE
+            if boundary and boundary < scaled_side and boundary / scaled_side >= 1 - TILE_SLACK:
+                scale *= boundary / scaled_side
+
+    return max(1, math.floor(width * scale)), max(1, math.floor(height * scale))
+
+
+def preprocess_image(image_bytes: bytes, detail: ImageDetail = ImageDetail.AUTO) -> Tuple[bytes, str, dict]:
+    # Runs in a worker process, since decoding and encoding images is CPU-bound:
+    image = Image.open(io.BytesIO(image_bytes))
+    original_format = image.format
+
+    # Applying the EXIF orientation before the metadata is dropped:
+    image = ImageOps.exif_transpose(image)
+    original_size = image.size
+
+    size = target_size(*original_size, detail)
+    if size != original_size:
+        image = image.resize(size, Image.LANCZOS)
+
+    # JPEG has no transparency, so transparent images are placed on a white background:
+    if IMAGE_FORMAT == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    # Saving without the original info, so that EXIF and other metadata are stripped:
+    output = io.BytesIO()
+    image.save(output, format=IMAGE_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+    processed_bytes = output.getvalue()
+    mime_type = MIME_TYPES[IMAGE_FORMAT]
+
+    # Keeping the original if it was already smaller and didn't need resizing:
+    if size == original_size and len(image_bytes) <= len(processed_bytes) and original_format in MIME_TYPES:
+        processed_bytes, mime_type = image_bytes, MIME_TYPES[original_format]
+
+    stats = {
+        "original_bytes": len(image_bytes),
+        "processed_bytes": len(processed_bytes),
+        "original_size": original_size,
+        "processed_size": size,
+        "tiles": count_tiles(*size, detail),
+        "estimated_tokens": estimate_tokens(*size, detail),
+    }
+
+    return processed_bytes, mime_type, stats
+
+
+# Decoding and encoding images is CPU-bound, so it runs in worker processes:
+image_pool = ProcessPool(IMAGE_WORKERS)
+
+
+async def process_image(image_bytes: bytes, detail: ImageDetail = ImageDetail.AUTO) -> Tuple[bytes, str]:
+    processed_bytes, mime_type, stats = await image_pool.run(preprocess_image, image_bytes, detail)
+
+    bytes_saved = stats["original_bytes"] - stats["processed_bytes"]
+    metrics.increment("images.processed")
+    metrics.increment("images.bytes_saved", bytes_saved)
+    metrics.observe("images.tiles", stats["tiles"])
+    metrics.observe("images.estimated_tokens", stats["estimated_tokens"])
+
+    print(f"\033[1;36mProcessed image from {stats['original_size']} to {stats['processed_size']}, "
+          f"saving {bytes_saved} bytes ({stats['tiles']} tiles, ~{stats['estimated_tokens']} tokens).\033[0m")
+
+    return processed_bytes, mime_type
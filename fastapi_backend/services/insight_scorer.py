@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, insert, exists
+
+from .. import metrics
+from ..database import AsyncSessionLocal
+from ..models import Message, MessageInsight
+from ..enums import MessageType
+from .ml_services.keyword_extraction import KeywordExtractor
+
+
+# Scoring messages needs the embedding model, which is too memory-expensive for Render hosting, so it is opt-in:
+INSIGHT_SCORING = os.getenv("INSIGHT_SCORING", "").lower() in ("1", "true")
+
+# Messages are scored in batches - a batch is scored this long after its first message arrives, or sooner if it fills up:
+INSIGHT_SCORE_INTERVAL = float(os.getenv("INSIGHT_SCORE_INTERVAL", 0.05))
+INSIGHT_SCORE_BATCH_SIZE = int(os.getenv("INSIGHT_SCORE_BATCH_SIZE", 64))
+
+# Messages beyond this many waiting aren't queued, so requests never wait on scoring - they are caught up on later instead:
+INSIGHT_SCORE_QUEUE_SIZE = int(os.getenv("INSIGHT_SCORE_QUEUE_SIZE", 5000))
+
+# The messages that insights are used for (by the preference model):
+SCORED_TYPES = (MessageType.USER, MessageType.ASSISTANT)
+
+
+class InsightScorer:
+    # Scores new messages against the description categories in the background, and stores their insights.
+    # Messages are queued once they are committed, so the request returning never depends on scoring.
+    # Messages that weren't scored (because the queue was full, or the worker stopped) are found by catching up,
+    # which runs when the scorer starts and whenever messages were turned away.
+
+    def __init__(self, interval: float, batch_size: int, queue_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._behind = True
+        self._extractor: Optional[KeywordExtractor] = None
+
+
+    def start(self) -> None:
+        # Starting the scorer on the running event loop, if it isn't already running there:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done(): return
+
+        self._loop = loop
+        self._queue = asyncio.Queue(self.queue_size)
+        self._behind = True
+        self._task = loop.create_task(self._run())
+
+
+    def submit(self, message: Message) -> None:
+        # Never blocks - if the queue is full, the message is left to be caught up on once the scorer has caught up:
+        if message.type not in SCORED_TYPES: return
+        self.start()
+
+        try:
+            self._queue.put_nowait((message.id, message.text))
+        except asyncio.QueueFull:
+            metrics.increment("insight_scorer.dropped")
+            self._behind = True
+
+
+    async def _run(self) -> None:
+        while True:
+            if self._behind and self._queue.empty():
+                self._behind = False
+                try:
+                    await self.catch_up()
+                except Exception as e:
+                    print(f"\033[1;31mCouldn't catch up on scoring messages: {e}\033[0m")
+                    metrics.increment("insight_scorer.failures")
+                    self._behind = True
+                    await asyncio.sleep(max(self.interval, 1))
+                    continue
+
+            batch = [await self._queue.get()]
+
+            # Giving other messages a moment to be added to the batch:
+            if self.interval: await asyncio.sleep(self.interval)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                await self._score(batch)
+            except Exception as e:
+                # The messages keep having no insights, so they are scored again when catching up:
+                print(f"\033[1;31mCouldn't score {len(batch)} messages: {e}\033[0m")
+                metrics.increment("insight_scorer.failures")
+                self._behind = True
+            finally:
+                for _ in batch: self._queue.task_done()
+
+
+    async def catch_up(self) -> int:
+        # Scoring the messages that have no insights, oldest first, one batch at a time:
+        scored, after_id = 0, 0
+
+        while True:
+            async with AsyncSessionLocal() as db:
+                batch = (await db.execute(
+                    select(Message.id, Message.text)
+                    .filter(Message.id > after_id, Message.type.in_(SCORED_TYPES),
+                            ~exists().where(MessageInsight.message_id == Message.id))
+                    .order_by(Message.id).limit(self.batch_size)
+                )).all()
+
+            if not batch: return scored
+            await self._score([tuple(row) for row in batch])
+
+            scored += len(batch)
+            metrics.increment("insight_scorer.caught_up", len(batch))
+            after_id = batch[-1][0]
+            if len(batch) < self.batch_size: return scored
+
+            # New messages are scored first, and catching up continues after them:
+            if self._queue is not None and not self._queue.empty():
+                self._behind = True
+                return scored
+
+
+    async def _score(self, batch: List[Tuple[int, str]]) -> None:
+        start = time.perf_counter()
+
+        # Encoding is CPU-bound, so it runs in a thread to keep the event loop responsive.
+        # The model is loaded by the first batch, rather than when the application starts:
+        if self._extractor is None: self._extractor = KeywordExtractor()
+        scores = await asyncio.get_running_loop().run_in_executor(None, self._extractor.score_categories_batch, [text or "" for _, text in batch])
+
+        async with AsyncSessionLocal() as db:
+            # Skipping messages deleted since, or already scored (e.g. while catching up), in the same transaction as the insert.
+            # Locking the rest, so that other workers catching up at the same time skip them rather than scoring them twice:
+            pending = set((await db.scalars(
+                select(Message.id).filter(Message.id.in_([message_id for message_id, _ in batch]),
+                                          ~exists().where(MessageInsight.message_id == Message.id))
+                .with_for_update(skip_locked=True)
+            )).all())
+
+            rows = [
+                {"message_id": message_id, "category": category, "score": score}
+                for (message_id, _), message_scores in zip(batch, scores) if message_id in pending
+                for category, score in message_scores.items()
+            ]
+            if rows: await db.execute(insert(MessageInsight), rows)
+            await db.commit()
+
+        metrics.increment("insight_scorer.scored", len(pending))
+        metrics.observe("insight_scorer.batch_size", len(batch))
+        metrics.observe("insight_scorer.batch_seconds", time.perf_counter() - start)
+
+
+    async def close(self) -> None:
+        # Scoring the queued messages before stopping - any left unscored are caught up on after a restart:
+        if self._task is None or self._task.done() or self._loop is not asyncio.get_running_loop(): return
+
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+insight_scorer = InsightScorer(INSIGHT_SCORE_INTERVAL, INSIGHT_SCORE_BATCH_SIZE, INSIGHT_SCORE_QUEUE_SIZE)
+
+metrics.register_gauge("insight_scorer", lambda: {
+    "enabled": INSIGHT_SCORING, "queued": len(insight_scorer), "queue_size": INSIGHT_SCORE_QUEUE_SIZE,
+})
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sqlalchemy import insert, update
+
+from .. import metrics
+from ..database import AsyncSessionLocal
+from ..models import User, Message
+from ..enums import MessageType
+from . import context_builder
+
+
+# Messages from concurrent requests are inserted together - a batch is written this long after its first message arrives,
+# or sooner if it fills up:
+MESSAGE_WRITE_INTERVAL = float(os.getenv("MESSAGE_WRITE_INTERVAL", 0.005))
+MESSAGE_WRITE_BATCH_SIZE = int(os.getenv("MESSAGE_WRITE_BATCH_SIZE", 200))
+
+# Requests wait to queue their messages once this many are waiting, rather than the queue growing without limit:
+MESSAGE_WRITE_QUEUE_SIZE = int(os.getenv("MESSAGE_WRITE_QUEUE_SIZE", 2000))
+
+
+@dataclass
+class PendingWrite:
+    user_id: int
+    user_name: str
+    type: MessageType
+    text: str
+    audio_ref: Optional[str]
+    future: asyncio.Future = field(repr=False)
+
+
+class MessageWriter:
+    # Inserts queued messages in batches, using one transaction and one multi-row INSERT per batch.
+    # A single task writes the batches one after another, in the order the messages were queued,
+    # so each user's messages are always stored (and numbered) in the order they were sent.
+
+    def __init__(self, interval: float, batch_size: int, queue_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+    def _ensure_started(self) -> None:
+        # Starting the writer on the running event loop when it is first needed:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done(): return
+
+        self._loop = loop
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = loop.create_task(self._run())
+
+
+    async def write(self, user_id: int, user_name: str, type: MessageType, text: str, audio_ref: Optional[str] = None) -> Message:
+        # Returns the stored message once its batch has been committed, so the caller only responds once it is durable:
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put(PendingWrite(user_id, user_name, type, text, audio_ref, future))
+
+        # Shielding the write, so that a request being cancelled doesn't leave its batch waiting on it:
+        return await asyncio.shield(future)
+
+
+    async def _run(self) -> None:
+        while True:
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+
+                # Giving concurrent requests a moment to add their messages to the batch:
+                if self.interval: await asyncio.sleep(self.interval)
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+
+                await self._flush(batch)
+
+            except Exception as e:
+                # Failing the batch's messages and carrying on with the next batch, rather than the writer stopping
+                # and leaving every request waiting on it (and any queued after) waiting forever:
+                print(f"\033[1;31mMessage writer failed: {e}\033[0m")
+                metrics.increment("message_writer.errors")
+                for write in batch:
+                    if not write.future.done(): write.future.set_exception(e)
+
+                # Not retrying straight away, in case the failure isn't specific to the batch:
+                await asyncio.sleep(max(self.interval, 0.1))
+
+            finally:
+                for _ in batch: self._queue.task_done()
+
+
+    async def _flush(self, batch: List[PendingWrite]) -> None:
+        start = time.perf_counter()
+
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    insert(Message).returning(Message.id, Message.timestamp, Message.feedback, sort_by_parameter_order=True),
+                    [{"user_id": write.user_id, "type": write.type, "text": write.text, "audio_ref": write.audio_ref}
+                     for write in batch]
+                )).all()
+
+                # Bumping each user's history version once for all of their messages, in a consistent order,
+                # so that batches in different workers can't deadlock on the same users:
+                counts = Counter(write.user_id for write in batch)
+                versions = {}
+                for user_id in sorted(counts):
+                    versions[user_id] = await db.scalar(
+                        update(User).where(User.id == user_id)
+                        .values(history_version=User.history_version + counts[user_id]).returning(User.history_version)
+                    )
+
+                await db.commit()
+
+        except Exception as e:
+            metrics.increment("message_writer.failures")
+
+            # Writing the messages one at a time, so that one invalid message (e.g. of a deleted user) doesn't fail the rest:
+            if len(batch) > 1:
+                for write in batch: await self._flush([write])
+                return
+
+            if not batch[0].future.done(): batch[0].future.set_exception(e)
+            return
+
+        metrics.observe("message_writer.batch_size", len(batch))
+        metrics.observe("message_writer.flush_seconds", time.perf_counter() - start)
+
+        # Each message corresponds to its own version, counting up to the user's new version:
+        next_versions = {user_id: version - counts[user_id] + 1 for user_id, version in versions.items()}
+
+        for write, (message_id, timestamp, feedback) in zip(batch, rows):
+            message = Message(id=message_id, user_id=write.user_id, type=write.type, text=write.text,
+                              audio_ref=write.audio_ref, timestamp=timestamp, feedback=feedback)
+
+            # Writing the message through to the cached history, so that the next request doesn't need to read it:
+            context_builder.record_message(write.user_id, write.user_name, message, next_versions[write.user_id])
+            next_versions[write.user_id] += 1
+
+            if not write.future.done(): write.future.set_result(message)
+
+
+    async def close(self) -> None:
+        # Writing any queued messages before stopping:
+        if self._task is None or self._task.done() or self._loop is not asyncio.get_running_loop(): return
+
+        await self._queue.join()
+        self._task.cancel()
+        self._task = None
+
+
+    def __len__(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+message_writer = MessageWriter(MESSAGE_WRITE_INTERVAL, MESSAGE_WRITE_BATCH_SIZE, MESSAGE_WRITE_QUEUE_SIZE)
+
+metrics.register_gauge("message_writer", lambda: {"queued": len(message_writer), "queue_size": MESSAGE_WRITE_QUEUE_SIZE})
@@ -0,0 +1,96 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+# Which implementation of the embedding model is used - the ONNX backend gives close scores without loading torch:
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# Directory of the exported ONNX model (model_quantized.onnx) and its tokenizer (tokenizer.json),
+# created with: python -m fastapi_backend.services.ml_services.export_onnx - by default next to the package:
+EMBEDDING_MODEL_DIR = os.getenv("EMBEDDING_MODEL_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "embedding_models", "all-MiniLM-L6-v2-int8"
+))
+
+# MiniLM was trained on inputs of up to this many tokens, so longer inputs are truncated, as sentence-transformers does:
+MAX_SEQUENCE_LENGTH = 256
+
+
+class EmbeddingBackend(ABC):
+    # Encodes texts into L2-normalized embeddings, one row per text:
+
+    @abstractmethod
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray: ...
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    # The reference implementation, which needs torch:
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+
+
+class OnnxBackend(EmbeddingBackend):
+    # The same model with int8 weights, run by ONNX Runtime on the CPU - it only needs onnxruntime and tokenizers.
+    # The mean pooling and normalization that sentence-transformers applies after the transformer are done with numpy:
+
+    def __init__(self, model_dir: str = EMBEDDING_MODEL_DIR, threads: Optional[int] = None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(MAX_SEQUENCE_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if threads: options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model_quantized.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+
+    def encode(self, texts: Sequence[str], batch_size: int = 64) -> np.ndarray:
+        batches = [self._encode_batch(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+        return np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+
+    def _encode_batch(self, texts: Sequence[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(list(texts))
+        inputs = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+
+        # Averaging the embeddings of the tokens, ignoring the padding:
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+BACKENDS = {"sentence-transformers": SentenceTransformerBackend, "onnx": OnnxBackend}
+
+
+def get_embedding_backend(name: str = EMBEDDING_BACKEND) -> EmbeddingBackend:
+    if name not in BACKENDS: raise ValueError(f"Unknown embedding backend '{name}', expected one of: {list(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+def get_backend_version(name: str = EMBEDDING_BACKEND) -> str:
+    # Identifies the embeddings a configured backend produces, so that saved embeddings are only reused with the same model:
+    if name == "onnx":
+        path = os.path.join(EMBEDDING_MODEL_DIR, "model_quantized.onnx")
+        return f"onnx:{path}:{os.path.getsize(path) if os.path.exists(path) else 0}"
+    return f"{name}:{EMBEDDING_MODEL}"
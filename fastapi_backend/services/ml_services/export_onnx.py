@@ -0,0 +1,53 @@
+import os
+import argparse
+
+from .embedding_backends import EMBEDDING_MODEL, EMBEDDING_MODEL_DIR
+
+# Exports the embedding model to ONNX with int8 weights, along with its tokenizer, for the ONNX embedding backend.
+# Exporting needs torch and transformers, so it is run once when building, and only the output is deployed.
+# Usage: python -m fastapi_backend.services.ml_services.export_onnx [--model all-MiniLM-L6-v2] [--output DIR]
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def export_model(model_name: str = EMBEDDING_MODEL, output_dir: str = EMBEDDING_MODEL_DIR) -> str:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    repository = f"sentence-transformers/{model_name}"
+    tokenizer = AutoTokenizer.from_pretrained(repository)
+    model = AutoModel.from_pretrained(repository).eval()
+
+    # Saving the tokenizer writes tokenizer.json, which the tokenizers library loads without transformers:
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    # Exporting the transformer with the batch size and sequence length left dynamic:
+    example = tokenizer(["An example sentence to trace the model with."], return_tensors="pt")
+    full_precision_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(example[name] for name in INPUT_NAMES), full_precision_path,
+            input_names=INPUT_NAMES, output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES},
+                          "last_hidden_state": {0: "batch", 1: "sequence"}, "pooler_output": {0: "batch"}},
+            opset_version=14,
+        )
+
+    # Quantizing the weights to int8, which makes the model about four times smaller and faster on the CPU:
+    quantized_path = os.path.join(output_dir, "model_quantized.onnx")
+    quantize_dynamic(full_precision_path, quantized_path, weight_type=QuantType.QInt8)
+    os.remove(full_precision_path)
+
+    print(f"\033[1;32mExported {model_name} to {quantized_path}.\033[0m")
+    return quantized_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--output", default=EMBEDDING_MODEL_DIR)
+    args = parser.parse_args()
+
+    export_model(args.model, args.output)
@@ -1,13 +1,32 @@
 import os
 import sys
 import threading
-from typing import Dict
+from typing import Dict, List, Optional, Sequence
 
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 
+from ... import metrics
 from ...enums import DescriptionCategory
+from ..cache import TTLCache, content_hash
+from .embedding_backends import EmbeddingBackend, get_embedding_backend, get_backend_version
+
+
+# How many texts the model encodes at once - larger batches are faster, up to the memory available:
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 64))
+
+# The category embeddings are saved here, so that starting up doesn't need to load the model and encode every keyword.
+# By default next to the package, wherever the application is started from:
+CATEGORY_EMBEDDINGS_CACHE = os.getenv("CATEGORY_EMBEDDINGS_CACHE", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "category_embeddings.npz"
+))
+
+# Embeddings of recent inputs, since the same requests ("describe this", "what does it say?") are made again and again:
+INPUT_EMBEDDING_CACHE_SIZE = int(os.getenv("INPUT_EMBEDDING_CACHE_SIZE", 5000))
+
+
+def normalize_text(text: str) -> str:
+    # The model is uncased and ignores extra whitespace, so differences in either don't change the embedding:
+    return " ".join(text.lower().split())
 
 
 class KeywordExtractor:
@@ -16,7 +35,13 @@ class KeywordExtractor:
     _instance = None
     _lock = threading.Lock()
 
-    def __new__(cls):
+    def __new__(cls, backend: Optional[EmbeddingBackend] = None):
+        # Passing a backend creates a separate extractor using it, e.g. to compare backends:
+        if backend is not None:
+            extractor = super(KeywordExtractor, cls).__new__(cls)
+            extractor._initialize(backend)
+            return extractor
+
         if cls._instance is None:
             with cls._lock:
                 if cls._instance is None:
@@ -25,10 +50,12 @@ class KeywordExtractor:
         return cls._instance
 
 
-    def _initialize(self):
+    def _initialize(self, backend: Optional[EmbeddingBackend] = None):
 
-        # Initializing the model and pre-computing category embeddings:
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        # The model (the backend set by EMBEDDING_BACKEND) is only loaded once it is first needed:
+        self._model = backend
+        self._model_lock = threading.RLock()
+        self._embeddings = TTLCache(INPUT_EMBEDDING_CACHE_SIZE)
 
         # Defining category keywords for embedding similarity:
         self.CATEGORY_KEYWORDS = {
@@ -73,167 +100,244 @@ class KeywordExtractor:
         }
 
 
-        # Pre-computing and storing the normalized average embeddings for each category:
-        self.CATEGORY_EMBEDDINGS = {}
-        for category, keywords in self.CATEGORY_KEYWORDS.items():
-            keyword_embeddings = self.model.encode(keywords, convert_to_tensor=False)
+        self.categories = list(self.CATEGORY_KEYWORDS)
+
+        # The saved category embeddings are only used if they were made by the same model from the same keywords.
+        # A backend passed in may not be the configured one, so its category embeddings aren't saved:
+        self._cache_version = None if backend is not None else content_hash(get_backend_version(), repr(self.CATEGORY_KEYWORDS))
+        self._category_matrix = self._load_category_matrix() if self._cache_version else None
+
+
+    @property
+    def model(self) -> EmbeddingBackend:
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None: self._model = get_embedding_backend()
+        return self._model
+
+
+    @property
+    def category_matrix(self) -> np.ndarray:
+        # The normalized average embedding of each category, as the rows of a single matrix,
+        # so that texts can be scored against every category with one matrix multiplication:
+        if self._category_matrix is None:
+            with self._model_lock:
+                if self._category_matrix is None:
+                    category_matrix = self._encode_categories()
+                    if self._cache_version: self._save_category_matrix(category_matrix)
+                    self._category_matrix = category_matrix
+        return self._category_matrix
+
+
+    @property
+    def CATEGORY_EMBEDDINGS(self) -> Dict[DescriptionCategory, np.ndarray]:
+        return dict(zip(self.categories, self.category_matrix))
+
+
+    def _encode_categories(self) -> np.ndarray:
+        category_embeddings = []
+        for keywords in self.CATEGORY_KEYWORDS.values():
+            keyword_embeddings = self.model.encode(keywords)
             avg_embedding = np.mean(keyword_embeddings, axis=0)
             norm = np.linalg.norm(avg_embedding)
-            normalized_embedding = avg_embedding / norm if norm != 0 else avg_embedding
-            self.CATEGORY_EMBEDDINGS[category] = normalized_embedding
+            category_embeddings.append(avg_embedding / norm if norm != 0 else avg_embedding)
 
+        return np.stack(category_embeddings).astype(np.float32)
 
-    def score_categories(self, user_input: str) -> Dict[DescriptionCategory, float]:
-        if not user_input.strip():
-            return {category: 0.0 for category in self.CATEGORY_EMBEDDINGS}
-
-        # Encoding and normalizing the user input:
-        input_embedding = self.model.encode([user_input], convert_to_tensor=False)[0]
-        norm = np.linalg.norm(input_embedding)
-        input_embedding = input_embedding / norm if norm != 0 else input_embedding
-
-        scores = {}
-        for category, embedding in self.CATEGORY_EMBEDDINGS.items():
-            similarity = cosine_similarity(
-                input_embedding.reshape(1, -1),
-                embedding.reshape(1, -1)
-            )[0][0]
-            scores[category] = float(similarity)
 
+    def _load_category_matrix(self) -> Optional[np.ndarray]:
+        try:
+            with np.load(CATEGORY_EMBEDDINGS_CACHE) as saved:
+                if str(saved["version"]) != self._cache_version: return None
+                return saved["matrix"].astype(np.float32)
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+    def _save_category_matrix(self, category_matrix: np.ndarray) -> None:
+        # Writing to a temporary file first, so that other workers never load a partially written file:
+        temporary_path = f"{CATEGORY_EMBEDDINGS_CACHE}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as f:
+                np.savez(f, version=np.array(self._cache_version), matrix=category_matrix)
+            os.replace(temporary_path, CATEGORY_EMBEDDINGS_CACHE)
+        except OSError as e:
+            print(f"\033[1;31mCouldn't save the category embeddings: {e}\033[0m")
+
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        # Encoding each distinct text once, reusing the embeddings of texts that were encoded recently:
+        keys = [normalize_text(text) for text in texts]
+        embeddings = [self._embeddings.get(key) for key in keys]
+
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+        metrics.increment("keyword_embeddings.hits", len(keys) - sum(embedding is None for embedding in embeddings))
+        metrics.increment("keyword_embeddings.misses", sum(embedding is None for embedding in embeddings))
+
+        if missing:
+            encoded = dict(zip(missing, self.model.encode(missing, batch_size=ENCODE_BATCH_SIZE)))
+            for key, embedding in encoded.items(): self._embeddings.set(key, embedding)
+            embeddings = [embedding if embedding is not None else encoded[key] for key, embedding in zip(keys, embeddings)]
+
+        return np.stack(embeddings)
+
+
+    def score_matrix(self, texts: Sequence[str]) -> np.ndarray:
+        # Returns the similarity of each text to each category, as a (texts x categories) matrix.
+        # Empty texts aren't encoded, and score 0 for every category:
+        scores = np.zeros((len(texts), len(self.categories)), dtype=np.float32)
+        indices = [index for index, text in enumerate(texts) if text.strip()]
+        if not indices: return scores
+
+        # Both sides are normalized, so their dot products are the cosine similarities:
+        scores[indices] = self.encode([texts[index] for index in indices]) @ self.category_matrix.T
         return scores
 
 
+    def score_categories_batch(self, texts: Sequence[str]) -> List[Dict[DescriptionCategory, float]]:
+        return [dict(zip(self.categories, row.tolist())) for row in self.score_matrix(texts)]
+
+
+    def score_categories(self, user_input: str) -> Dict[DescriptionCategory, float]:
+        return self.score_categories_batch([user_input])[0]
+
+
+# Example requests and the category each should score highest for:
+TEST_CASES = [
+    # Scene Category (10 test cases)
+    ("What is the environment like?", DescriptionCategory.SCENE),
+    ("Where is this scene taking place?", DescriptionCategory.SCENE),
+    ("Is the setting indoors or outdoors?", DescriptionCategory.SCENE),
+    ("What kind of environment is depicted?", DescriptionCategory.SCENE),
+    ("Can you tell me about the background?", DescriptionCategory.SCENE),
+    ("What does the landscape look like?", DescriptionCategory.SCENE),
+    ("Is there any notable scenery?", DescriptionCategory.SCENE),
+    ("What's the location shown in the image?", DescriptionCategory.SCENE),
+    ("Are there any landmarks visible?", DescriptionCategory.SCENE),
+    ("Can you describe the area where the action is happening?", DescriptionCategory.SCENE),
+
+    # People Category (10 test cases)
+    ("Are there any people in the image?", DescriptionCategory.PEOPLE),
+    ("Can you describe the individuals present?", DescriptionCategory.PEOPLE),
+    ("What do the people look like?", DescriptionCategory.PEOPLE),
+    ("How many people are there?", DescriptionCategory.PEOPLE),
+    ("Can you tell me about their appearance?", DescriptionCategory.PEOPLE),
+    ("What are the ages of the people?", DescriptionCategory.PEOPLE),
+    ("Are they male or female?", DescriptionCategory.PEOPLE),
+    ("Can you describe who is in the group?", DescriptionCategory.PEOPLE),
+    ("What expressions do the people have?", DescriptionCategory.PEOPLE),
+    ("Is there any interaction between the people?", DescriptionCategory.PEOPLE),
+
+    # Activity Category (10 test cases)
+    ("What are the people doing?", DescriptionCategory.ACTIVITY),
+    ("Is there any action taking place?", DescriptionCategory.ACTIVITY),
+    ("Can you describe any movements?", DescriptionCategory.ACTIVITY),
+    ("Are they engaged in any activities?", DescriptionCategory.ACTIVITY),
+    ("What is happening in the image?", DescriptionCategory.ACTIVITY),
+    ("Is anyone performing a specific task?", DescriptionCategory.ACTIVITY),
+    ("Are there any events occurring?", DescriptionCategory.ACTIVITY),
+    ("Can you tell me about any gestures?", DescriptionCategory.ACTIVITY),
+    ("What actions are visible?", DescriptionCategory.ACTIVITY),
+    ("Is there any interaction happening?", DescriptionCategory.ACTIVITY),
+
+    # Emotion Category (10 test cases)
+    ("Can you tell how the people are feeling?", DescriptionCategory.EMOTION),
+    ("What emotions are displayed?", DescriptionCategory.EMOTION),
+    ("Do they look happy or sad?", DescriptionCategory.EMOTION),
+    ("Can you describe their facial expressions?", DescriptionCategory.EMOTION),
+    ("Is there any sign of excitement?", DescriptionCategory.EMOTION),
+    ("How would you describe their mood?", DescriptionCategory.EMOTION),
+    ("Are they showing any emotions?", DescriptionCategory.EMOTION),
+    ("What is the emotional tone?", DescriptionCategory.EMOTION),
+    ("Can you sense any feelings from the image?", DescriptionCategory.EMOTION),
+    ("Are there any expressions of anger or joy?", DescriptionCategory.EMOTION),
+
+    # Atmosphere Category (10 test cases)
+    ("What's the overall atmosphere like?", DescriptionCategory.ATMOSPHERE),
+    ("Can you describe the mood of the scene?", DescriptionCategory.ATMOSPHERE),
+    ("Does the image convey a particular vibe?", DescriptionCategory.ATMOSPHERE),
+    ("Is there a tense or relaxed ambiance?", DescriptionCategory.ATMOSPHERE),
+    ("How would you describe the tone?", DescriptionCategory.ATMOSPHERE),
+    ("Is the scene vibrant or gloomy?", DescriptionCategory.ATMOSPHERE),
+    ("What's the general feeling you get from the image?", DescriptionCategory.ATMOSPHERE),
+    ("Does the setting have a peaceful aura?", DescriptionCategory.ATMOSPHERE),
+    ("Can you tell me about the energy in the scene?", DescriptionCategory.ATMOSPHERE),
+    ("What is the vibe of the image?", DescriptionCategory.ATMOSPHERE),
+
+    # Color Category (10 test cases)
+    ("What are the main colors in the image?", DescriptionCategory.COLOR),
+    ("Can you describe the color palette?", DescriptionCategory.COLOR),
+    ("Are there any bright or vivid colors?", DescriptionCategory.COLOR),
+    ("Is the image mostly dark or light?", DescriptionCategory.COLOR),
+    ("Are there any contrasting colors?", DescriptionCategory.COLOR),
+    ("How would you describe the hues present?", DescriptionCategory.COLOR),
+    ("Is the scene colorful or monochrome?", DescriptionCategory.COLOR),
+    ("Do any colors stand out?", DescriptionCategory.COLOR),
+    ("Are there any shades or tints you can mention?", DescriptionCategory.COLOR),
+    ("Does the image have saturated or muted tones?", DescriptionCategory.COLOR),
+
+    # Text Category (10 test cases)
+    ("Is there any text visible in the image?", DescriptionCategory.TEXT),
+    ("Can you read any signs or labels?", DescriptionCategory.TEXT),
+    ("What does the writing say?", DescriptionCategory.TEXT),
+    ("Are there any posters or billboards?", DescriptionCategory.TEXT),
+    ("Is there any graffiti or messages?", DescriptionCategory.TEXT),
+    ("Can you tell me about any letters or words?", DescriptionCategory.TEXT),
+    ("Is there a caption or title shown?", DescriptionCategory.TEXT),
+    ("Are there any notices or announcements?", DescriptionCategory.TEXT),
+    ("Does the image contain any readable content?", DescriptionCategory.TEXT),
+    ("Can you describe any text elements present?", DescriptionCategory.TEXT),
+
+    # Objects Category (10 test cases)
+    ("Can you describe the objects in the image?", DescriptionCategory.OBJECTS),
+    ("What items are present?", DescriptionCategory.OBJECTS),
+    ("Are there any vehicles or devices?", DescriptionCategory.OBJECTS),
+    ("Can you tell me about any tools or equipment?", DescriptionCategory.OBJECTS),
+    ("What kind of furniture is visible?", DescriptionCategory.OBJECTS),
+    ("Are there any significant artifacts?", DescriptionCategory.OBJECTS),
+    ("Do you see any appliances or gadgets?", DescriptionCategory.OBJECTS),
+    ("Can you describe any props or items?", DescriptionCategory.OBJECTS),
+    ("Are there any symbols or icons present?", DescriptionCategory.OBJECTS),
+    ("What things are in the scene?", DescriptionCategory.OBJECTS),
+
+    # Detail Category (10 test cases)
+    ("Can you provide more detailed information?", DescriptionCategory.DETAIL),
+    ("I would like an in-depth description.", DescriptionCategory.DETAIL),
+    ("Please describe all the specifics.", DescriptionCategory.DETAIL),
+    ("Can you elaborate on the image?", DescriptionCategory.DETAIL),
+    ("Tell me all the fine details.", DescriptionCategory.DETAIL),
+    ("I prefer a thorough explanation.", DescriptionCategory.DETAIL),
+    ("Can you be more specific?", DescriptionCategory.DETAIL),
+    ("Describe everything in detail.", DescriptionCategory.DETAIL),
+    ("Please give me an exhaustive description.", DescriptionCategory.DETAIL),
+    ("Can you provide a comprehensive overview?", DescriptionCategory.DETAIL),
+
+    # Conciseness Category (10 test cases)
+    ("Can you give me a brief summary?", DescriptionCategory.CONCISENESS),
+    ("Please keep the description short.", DescriptionCategory.CONCISENESS),
+    ("I prefer a concise explanation.", DescriptionCategory.CONCISENESS),
+    ("Can you summarize the image quickly?", DescriptionCategory.CONCISENESS),
+    ("Just highlight the main points.", DescriptionCategory.CONCISENESS),
+    ("Give me a quick overview.", DescriptionCategory.CONCISENESS),
+    ("Please be succinct.", DescriptionCategory.CONCISENESS),
+    ("Make it short and to the point.", DescriptionCategory.CONCISENESS),
+    ("Can you provide a brief description?", DescriptionCategory.CONCISENESS),
+    ("I'd like an abbreviated version.", DescriptionCategory.CONCISENESS),
+]
+
+
 def test_scoring():
     keyword_extractor = KeywordExtractor()
-
-    test_cases = [
-        # Scene Category (10 test cases)
-        ("What is the environment like?", DescriptionCategory.SCENE),
-        ("Where is this scene taking place?", DescriptionCategory.SCENE),
-        ("Is the setting indoors or outdoors?", DescriptionCategory.SCENE),
-        ("What kind of environment is depicted?", DescriptionCategory.SCENE),
-        ("Can you tell me about the background?", DescriptionCategory.SCENE),
-        ("What does the landscape look like?", DescriptionCategory.SCENE),
-        ("Is there any notable scenery?", DescriptionCategory.SCENE),
-        ("What's the location shown in the image?", DescriptionCategory.SCENE),
-        ("Are there any landmarks visible?", DescriptionCategory.SCENE),
-        ("Can you describe the area where the action is happening?", DescriptionCategory.SCENE),
-
-        # People Category (10 test cases)
-        ("Are there any people in the image?", DescriptionCategory.PEOPLE),
-        ("Can you describe the individuals present?", DescriptionCategory.PEOPLE),
-        ("What do the people look like?", DescriptionCategory.PEOPLE),
-        ("How many people are there?", DescriptionCategory.PEOPLE),
-        ("Can you tell me about their appearance?", DescriptionCategory.PEOPLE),
-        ("What are the ages of the people?", DescriptionCategory.PEOPLE),
-        ("Are they male or female?", DescriptionCategory.PEOPLE),
-        ("Can you describe who is in the group?", DescriptionCategory.PEOPLE),
-        ("What expressions do the people have?", DescriptionCategory.PEOPLE),
-        ("Is there any interaction between the people?", DescriptionCategory.PEOPLE),
-
-        # Activity Category (10 test cases)
-        ("What are the people doing?", DescriptionCategory.ACTIVITY),
-        ("Is there any action taking place?", DescriptionCategory.ACTIVITY),
-        ("Can you describe any movements?", DescriptionCategory.ACTIVITY),
-        ("Are they engaged in any activities?", DescriptionCategory.ACTIVITY),
-        ("What is happening in the image?", DescriptionCategory.ACTIVITY),
-        ("Is anyone performing a specific task?", DescriptionCategory.ACTIVITY),
-        ("Are there any events occurring?", DescriptionCategory.ACTIVITY),
-        ("Can you tell me about any gestures?", DescriptionCategory.ACTIVITY),
-        ("What actions are visible?", DescriptionCategory.ACTIVITY),
-        ("Is there any interaction happening?", DescriptionCategory.ACTIVITY),
-
-        # Emotion Category (10 test cases)
-        ("Can you tell how the people are feeling?", DescriptionCategory.EMOTION),
-        ("What emotions are displayed?", DescriptionCategory.EMOTION),
-        ("Do they look happy or sad?", DescriptionCategory.EMOTION),
-        ("Can you describe their facial expressions?", DescriptionCategory.EMOTION),
-        ("Is there any sign of excitement?", DescriptionCategory.EMOTION),
-        ("How would you describe their mood?", DescriptionCategory.EMOTION),
-        ("Are they showing any emotions?", DescriptionCategory.EMOTION),
-        ("What is the emotional tone?", DescriptionCategory.EMOTION),
-        ("Can you sense any feelings from the image?", DescriptionCategory.EMOTION),
-        ("Are there any expressions of anger or joy?", DescriptionCategory.EMOTION),
-
-        # Atmosphere Category (10 test cases)
-        ("What's the overall atmosphere like?", DescriptionCategory.ATMOSPHERE),
-        ("Can you describe the mood of the scene?", DescriptionCategory.ATMOSPHERE),
-        ("Does the image convey a particular vibe?", DescriptionCategory.ATMOSPHERE),
-        ("Is there a tense or relaxed ambiance?", DescriptionCategory.ATMOSPHERE),
-        ("How would you describe the tone?", DescriptionCategory.ATMOSPHERE),
-        ("Is the scene vibrant or gloomy?", DescriptionCategory.ATMOSPHERE),
-        ("What's the general feeling you get from the image?", DescriptionCategory.ATMOSPHERE),
-        ("Does the setting have a peaceful aura?", DescriptionCategory.ATMOSPHERE),
-        ("Can you tell me about the energy in the scene?", DescriptionCategory.ATMOSPHERE),
-        ("What is the vibe of the image?", DescriptionCategory.ATMOSPHERE),
-
-        # Color Category (10 test cases)
-        ("What are the main colors in the image?", DescriptionCategory.COLOR),
-        ("Can you describe the color palette?", DescriptionCategory.COLOR),
-        ("Are there any bright or vivid colors?", DescriptionCategory.COLOR),
-        ("Is the image mostly dark or light?", DescriptionCategory.COLOR),
-        ("Are there any contrasting colors?", DescriptionCategory.COLOR),
-        ("How would you describe the hues present?", DescriptionCategory.COLOR),
-        ("Is the scene colorful or monochrome?", DescriptionCategory.COLOR),
-        ("Do any colors stand out?", DescriptionCategory.COLOR),
-        ("Are there any shades or tints you can mention?", DescriptionCategory.COLOR),
-        ("Does the image have saturated or muted tones?", DescriptionCategory.COLOR),
-
-        # Text Category (10 test cases)
-        ("Is there any text visible in the image?", DescriptionCategory.TEXT),
-        ("Can you read any signs or labels?", DescriptionCategory.TEXT),
-        ("What does the writing say?", DescriptionCategory.TEXT),
-        ("Are there any posters or billboards?", DescriptionCategory.TEXT),
-        ("Is there any graffiti or messages?", DescriptionCategory.TEXT),
-        ("Can you tell me about any letters or words?", DescriptionCategory.TEXT),
-        ("Is there a caption or title shown?", DescriptionCategory.TEXT),
-        ("Are there any notices or announcements?", DescriptionCategory.TEXT),
-        ("Does the image contain any readable content?", DescriptionCategory.TEXT),
-        ("Can you describe any text elements present?", DescriptionCategory.TEXT),
-
-        # Objects Category (10 test cases)
-        ("Can you describe the objects in the image?", DescriptionCategory.OBJECTS),
-        ("What items are present?", DescriptionCategory.OBJECTS),
-        ("Are there any vehicles or devices?", DescriptionCategory.OBJECTS),
-        ("Can you tell me about any tools or equipment?", DescriptionCategory.OBJECTS),
-        ("What kind of furniture is visible?", DescriptionCategory.OBJECTS),
-        ("Are there any significant artifacts?", DescriptionCategory.OBJECTS),
-        ("Do you see any appliances or gadgets?", DescriptionCategory.OBJECTS),
-        ("Can you describe any props or items?", DescriptionCategory.OBJECTS),
-        ("Are there any symbols or icons present?", DescriptionCategory.OBJECTS),
-        ("What things are in the scene?", DescriptionCategory.OBJECTS),
-
-        # Detail Category (10 test cases)
-        ("Can you provide more detailed information?", DescriptionCategory.DETAIL),
-        ("I would like an in-depth description.", DescriptionCategory.DETAIL),
-        ("Please describe all the specifics.", DescriptionCategory.DETAIL),
-        ("Can you elaborate on the image?", DescriptionCategory.DETAIL),
-        ("Tell me all the fine details.", DescriptionCategory.DETAIL),
-        ("I prefer a thorough explanation.", DescriptionCategory.DETAIL),
-        ("Can you be more specific?", DescriptionCategory.DETAIL),
-        ("Describe everything in detail.", DescriptionCategory.DETAIL),
-        ("Please give me an exhaustive description.", DescriptionCategory.DETAIL),
-        ("Can you provide a comprehensive overview?", DescriptionCategory.DETAIL),
-
-        # Conciseness Category (10 test cases)
-        ("Can you give me a brief summary?", DescriptionCategory.CONCISENESS),
-        ("Please keep the description short.", DescriptionCategory.CONCISENESS),
-        ("I prefer a concise explanation.", DescriptionCategory.CONCISENESS),
-        ("Can you summarize the image quickly?", DescriptionCategory.CONCISENESS),
-        ("Just highlight the main points.", DescriptionCategory.CONCISENESS),
-        ("Give me a quick overview.", DescriptionCategory.CONCISENESS),
-        ("Please be succinct.", DescriptionCategory.CONCISENESS),
-        ("Make it short and to the point.", DescriptionCategory.CONCISENESS),
-        ("Can you provide a brief description?", DescriptionCategory.CONCISENESS),
-        ("I'd like an abbreviated version.", DescriptionCategory.CONCISENESS),
-    ]
+    test_cases = TEST_CASES
 
     total_score = 0
     n_categories = len(keyword_extractor.CATEGORY_KEYWORDS)
     n_test_cases = len(test_cases)
 
-    for i, (input_text, expected_category) in enumerate(test_cases, 1):
-        scores = keyword_extractor.score_categories(input_text)
+    # Scoring every test case at once:
+    batch_scores = keyword_extractor.score_categories_batch([input_text for input_text, _ in test_cases])
+
+    for i, ((input_text, expected_category), scores) in enumerate(zip(test_cases, batch_scores), 1):
         sorted_scores = sorted(scores.items(), key=lambda item: item[1], reverse=True)
         expected_index = next(
             (index for index, (category, _) in enumerate(sorted_scores) if category == expected_category),
@@ -265,5 +369,20 @@ def test_scoring():
     final_accuracy = (total_score / n_test_cases) * 100
     print(f"Final Accuracy: {final_accuracy:.2f}%")
 
+def cache_stats() -> dict:
+    hits = metrics.get_counter("keyword_embeddings.hits")
+    lookups = hits + metrics.get_counter("keyword_embeddings.misses")
+    extractor = KeywordExtractor._instance
+
+    return {
+        "model_loaded": extractor is not None and extractor._model is not None,
+        "entries": len(extractor._embeddings) if extractor is not None else 0,
+        "hit_ratio": hits / lookups if lookups else None,
+    }
+
+
+metrics.register_gauge("keyword_embeddings", cache_stats)
+
+
 if __name__ == "__main__":
     test_scoring()
@@ -3,12 +3,13 @@ import logging
 
 # Random Forest Regressor is a ML model used for regression tasks:
 from sklearn.ensemble import RandomForestRegressor
+from sqlalchemy import select, func, exists, case, and_, or_
 from sqlalchemy.orm import Session, sessionmaker
 import numpy as np
 import pickle
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from ...models import User, Message, MessageInsight, MessageFeedback
+from ...models import Message, MessageInsight, MessageFeedback
 from ...enums import MessageType, DescriptionCategory
 from ...database import engine
 
@@ -18,63 +19,84 @@ logger = logging.getLogger(__name__)
 
 MODEL_PATH = 'preference_model.pkl'
 
+# How many rows of training data are fetched from the database at a time:
+TRAINING_YIELD_PER = int(os.getenv("TRAINING_YIELD_PER", 10000))
+
+# Each row of training data read - an insight of a message, with the sign of its label:
+TRAINING_ROW_DTYPE = np.dtype([("message_id", np.int64), ("sign", np.float64), ("category", np.int64), ("score", np.float64)])
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def training_messages():
+    # The messages the model learns from - user messages, whose insights are taken as preferences,
+    # and assistant messages with feedback, whose insights are taken as preferred or not:
+    return [
+        Message.user_id.isnot(None),
+        or_(Message.type == MessageType.USER,
+            and_(Message.type == MessageType.ASSISTANT,
+                 or_(Message.feedback.is_(None), Message.feedback != MessageFeedback.NEUTRAL))),
+    ]
+
+
 def prepare_training_data(db: Session):
-    # Creating a dictionary of categories and indices:
+    # Creating a dictionary of categories and indices - the categories are stored by name:
     categories = [category for category in DescriptionCategory]
-    category_to_index = {category: idx for idx, category in enumerate(categories)}
+    category_to_index = {category.name: idx for idx, category in enumerate(categories)}
 
     n_categories = len(categories)
 
-    # Initializing lists to store training data and corresponding labels:
-    training_data = []
-    labels = []
-
-    # Querying all users from the database:
-    users = db.query(User).all()
-
-    for user in users:
-        # Processing messages for each user in chronological order:
-        messages = db.query(Message).filter_by(user_id=user.id).order_by(Message.timestamp.asc()).all()
-        for message in messages:
-            # Retrieving message insights associated with the message:
-            message_insights = db.query(MessageInsight).filter_by(message_id=message.id).all()
-            if not message_insights:
-                continue
-
-            # Initializing a feature vector with zeros for all categories:
-            feature_vector = [0.0] * n_categories
-
-            # Setting scores for categories present in message insights:
-            for insight in message_insights:
-                idx = category_to_index[insight.category]
-                feature_vector[idx] = insight.score
-
-            # Initializing a label vector with zeros:
-            label_vector = [0.0] * n_categories
-
-            if message.type == MessageType.USER:
-                # For user messages, using the feature vector as labels (assuming user preferences):
-                label_vector = feature_vector.copy()
-            elif message.type == MessageType.ASSISTANT and message.feedback != MessageFeedback.NEUTRAL:
-                # For assistant messages with feedback, adjusting the insights based on feedback:
-                adjustment = 1.0 if message.feedback == MessageFeedback.POSITIVE else -1.0
-                for idx in range(n_categories):
-                    label_vector[idx] = feature_vector[idx] * adjustment
-            else:
-                continue
-
-            # Appending feature vector and label vector to training data:
-            training_data.append(feature_vector)
-            labels.append(label_vector)
-
-    
-    print(f"\033[1;34mPrepared training data for user.\033[0m")
-
-    # Returning the training data and labels as NumPy arrays:
-    return np.array(training_data), np.array(labels)
+    # Counting the messages with insights, so that the matrices can be allocated once rather than built up from lists.
+    # The features are float32, which the trees convert them to anyway, and the labels are float64, as they use:
+    n_messages = db.scalar(
+        select(func.count()).select_from(Message)
+        .filter(*training_messages(), exists().where(MessageInsight.message_id == Message.id))
+    )
+    training_data = np.zeros((n_messages, n_categories), dtype=np.float32)
+    signs = np.zeros(n_messages, dtype=np.float64)
+
+    # Reading every insight of those messages in one query, streamed in chunks from a server-side cursor,
+    # in the order the messages were sent by each user (as the index is), so that the insights of each message are adjacent.
+    # Only numbers are selected, and without the ORM, so that each chunk can be copied straight into an array.
+    # User messages and positive feedback keep the scores as labels, and other feedback negates them:
+    sign = case((Message.type == MessageType.USER, 1.0), (Message.feedback == MessageFeedback.POSITIVE, 1.0), else_=-1.0)
+    result = db.connection().execute(
+        select(Message.id, sign, case(category_to_index, value=MessageInsight.category), MessageInsight.score)
+        .join(MessageInsight, MessageInsight.message_id == Message.id)
+        .filter(*training_messages(), MessageInsight.score.isnot(None))
+        .order_by(Message.user_id, Message.timestamp, Message.id)
+        .execution_options(yield_per=TRAINING_YIELD_PER)
+    )
+
+    # Index of the row of the last message read, which may continue into the next chunk:
+    row, last_message_id = -1, None
+
+    for chunk in result.partitions():
+        chunk = np.fromiter(map(tuple, chunk), dtype=TRAINING_ROW_DTYPE, count=len(chunk))
+        message_ids = chunk["message_id"]
+
+        # Each insight of a different message from the one before starts the next row:
+        new_rows = np.empty(len(message_ids), dtype=bool)
+        new_rows[0] = message_ids[0] != last_message_id
+        new_rows[1:] = message_ids[1:] != message_ids[:-1]
+        rows = row + np.cumsum(new_rows)
+
+        # Messages (and their insights) added since they were counted are given more rows:
+        if rows[-1] >= len(training_data):
+            extra = rows[-1] + 1 - len(training_data)
+            training_data = np.concatenate([training_data, np.zeros((extra, n_categories), dtype=np.float32)])
+            signs = np.concatenate([signs, np.zeros(extra)])
+
+        training_data[rows, chunk["category"]] = chunk["score"]
+        signs[rows] = chunk["sign"]
+        row, last_message_id = rows[-1], message_ids[-1]
+
+    # Dropping the rows of any messages deleted since they were counted:
+    training_data, signs = training_data[:row + 1], signs[:row + 1]
+    labels = training_data * signs[:, None]
+
+    print(f"\033[1;34mPrepared training data from {len(training_data)} messages.\033[0m")
+    return training_data, labels
 
 
 def train_preference_model():
@@ -0,0 +1,58 @@
+import os
+import time
+
+from .. import metrics
+from ..exceptions import ServerBusyException
+from ..security import bcrypt_context
+from .process_pool import ProcessPool
+
+
+# Hashing is slow by design, so it runs in worker processes where it can't hold up the event loop or each other:
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", 2))
+
+# The most hashes waiting or running at once - beyond this, requests are turned away rather than queued for seconds:
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", 4 * PASSWORD_WORKERS))
+
+
+def hash_password_sync(password: str) -> str:
+    return bcrypt_context.hash(password)
+
+
+def verify_password_sync(password: str, password_hash: str) -> bool:
+    return bcrypt_context.verify(password, password_hash)
+
+
+password_pool = ProcessPool(PASSWORD_WORKERS)
+
+# Only changed from the event loop, so no locking is needed:
+_in_flight = 0
+
+
+async def run_in_pool(name: str, function, *args):
+    global _in_flight
+    if _in_flight >= PASSWORD_QUEUE_LIMIT:
+        metrics.increment("passwords.rejected")
+        raise ServerBusyException
+
+    _in_flight += 1
+    start = time.perf_counter()
+    try:
+        return await password_pool.run(function, *args)
+    finally:
+        _in_flight -= 1
+        metrics.observe(f"passwords.{name}.seconds", time.perf_counter() - start)
+
+
+async def hash_password(password: str) -> str:
+    return await run_in_pool("hash", hash_password_sync, password)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await run_in_pool("verify", verify_password_sync, password, password_hash)
+
+
+def pool_stats() -> dict:
+    return {"in_flight": _in_flight, "queue_limit": PASSWORD_QUEUE_LIMIT, "workers": PASSWORD_WORKERS}
+
+
+metrics.register_gauge("passwords", pool_stats)
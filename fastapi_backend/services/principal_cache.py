@@ -0,0 +1,118 @@
+import os
+import time
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple
+
+from sqlalchemy import event
+
+from .. import metrics
+from ..models import User, UserInsight
+from ..enums import DescriptionCategory
+from .cache import TTLCache
+
+
+# Verified tokens, so that each token's signature is only checked once per worker - bounded, since every login adds one:
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 10000))
+
+# Snapshots of recently authenticated users, which are loaded again after the TTL.
+# Other workers can't invalidate this worker's snapshots, so the TTL is how long their changes can take to be seen:
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 1000))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 30))
+
+
+@dataclass(frozen=True)
+class InsightSnapshot:
+    category: DescriptionCategory
+    score: float
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    # The parts of a user needed to handle a request, detached from any session so that it can be shared between requests.
+    # The password hash isn't kept, and neither is the history version, since every new message changes it -
+    # leaving it unknown makes the history cache check it against the DB:
+    id: int
+    name: str
+    email: str
+    is_admin: bool
+    insights: Tuple[InsightSnapshot, ...]
+    history_version: Optional[int] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        insights = tuple(InsightSnapshot(insight.category, insight.score) for insight in user.insights)
+        return cls(user.id, user.name, user.email, bool(user.is_admin), insights)
+
+
+# Each token maps to its user ID and expiry time:
+_tokens = TTLCache(JWT_CACHE_SIZE)
+_principals = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL) if PRINCIPAL_CACHE_TTL > 0 else None
+
+
+def get_token_subject(token: str) -> Optional[int]:
+    entry = _tokens.get(token)
+    if entry is None:
+        metrics.increment("jwt_cache.misses")
+        return None
+
+    # Tokens stop being accepted when they expire, just as if they were decoded again:
+    user_id, expiry = entry
+    if expiry is not None and expiry <= time.time():
+        _tokens.delete(token)
+        metrics.increment("jwt_cache.misses")
+        return None
+
+    metrics.increment("jwt_cache.hits")
+    return user_id
+
+
+def set_token_subject(token: str, user_id: int, expiry: Optional[float]) -> None:
+    _tokens.set(token, (user_id, expiry))
+
+
+def get_principal(user_id: int) -> Optional[UserSnapshot]:
+    principal = _principals.get(user_id) if _principals is not None else None
+    metrics.increment("principal_cache.hits" if principal is not None else "principal_cache.misses")
+    return principal
+
+
+def set_principal(user: User) -> UserSnapshot:
+    principal = UserSnapshot.from_user(user)
+    if _principals is not None: _principals.set(user.id, principal)
+
+    # The history version was just loaded, so it can be used for this request:
+    return replace(principal, history_version=user.history_version)
+
+
+def invalidate(user_id: int) -> None:
+    if _principals is not None: _principals.delete(user_id)
+
+
+def clear() -> None:
+    _tokens.clear()
+    if _principals is not None: _principals.clear()
+
+
+@event.listens_for(UserInsight, "after_insert")
+@event.listens_for(UserInsight, "after_update")
+@event.listens_for(UserInsight, "after_delete")
+def invalidate_insight_user(mapper, connection, insight: UserInsight) -> None:
+    # The snapshot includes the insights, so it is loaded again once they are changed in this worker:
+    invalidate(insight.user_id)
+
+
+def cache_stats() -> dict:
+    hits = metrics.get_counter("principal_cache.hits")
+    lookups = hits + metrics.get_counter("principal_cache.misses")
+    jwt_hits = metrics.get_counter("jwt_cache.hits")
+    jwt_lookups = jwt_hits + metrics.get_counter("jwt_cache.misses")
+
+    return {
+        "principals": len(_principals) if _principals is not None else 0,
+        "tokens": len(_tokens),
+        "hit_ratio": hits / lookups if lookups else None,
+        "jwt_hit_ratio": jwt_hits / jwt_lookups if jwt_lookups else None,
+    }
+
+
+metrics.register_gauge("principal_cache", cache_stats)
@@ -0,0 +1,30 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+
+class ProcessPool:
+    # Runs CPU-bound functions in worker processes, so that they don't hold up the event loop.
+    # The workers are started on first use, and spawned rather than forked, since forking a process running an event loop
+    # and threads is unsafe:
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.get_executor(), function, *args)
+
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,47 @@
+import os
+import tempfile
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .. import metrics
+from ..enums import TTSModel, OpenAIVoice
+from .cache import DiskStore, content_hash
+
+
+# Synthesized audio is kept on disk, shared by all workers using the same directory:
+SPEECH_CACHE_DIR = os.getenv("SPEECH_CACHE_DIR", os.path.join(tempfile.gettempdir(), "in-sight-speech-cache"))
+SPEECH_CACHE_MAX_BYTES = int(os.getenv("SPEECH_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+_store = DiskStore(SPEECH_CACHE_DIR, SPEECH_CACHE_MAX_BYTES)
+
+
+def make_key(text: str, tts_model: TTSModel, openai_voice: Optional[OpenAIVoice], audio_format: str) -> str:
+    # Neuphonic ignores the OpenAI voice, so it is left out of the key to share entries between voices:
+    voice = openai_voice.value if tts_model == TTSModel.OPENAI and openai_voice else None
+    return content_hash(text.strip(), tts_model.value, voice, audio_format)
+
+
+async def lookup(key: str) -> Optional[bytes]:
+    audio_bytes = await run_in_threadpool(_store.get, key)
+    metrics.increment("speech_cache.hits" if audio_bytes is not None else "speech_cache.misses")
+    return audio_bytes
+
+
+async def store(key: str, audio_bytes: bytes) -> None:
+    await run_in_threadpool(_store.set, key, audio_bytes)
+
+
+def cache_stats() -> dict:
+    hits = metrics.get_counter("speech_cache.hits")
+    lookups = hits + metrics.get_counter("speech_cache.misses")
+
+    return {
+        "entries": len(_store),
+        "bytes": _store.total_bytes,
+        "max_bytes": SPEECH_CACHE_MAX_BYTES,
+        "hit_ratio": hits / lookups if lookups else None,
+    }
+
+
+metrics.register_gauge("speech_cache", cache_stats)
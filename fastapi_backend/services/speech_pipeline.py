@@ -0,0 +1,149 @@
+import os
+import re
+import struct
+import asyncio
+from collections import deque
+from typing import AsyncGenerator, AsyncIterable, Awaitable, Callable, Deque, List, Optional, Tuple
+
+
+# How many sentences can be synthesized at the same time for a single response:
+SENTENCE_TTS_CONCURRENCY = int(os.getenv("SENTENCE_TTS_CONCURRENCY", 3))
+
+# Sentences shorter than this are joined with the next one, so that abbreviations and short phrases don't become separate requests:
+MIN_SENTENCE_LENGTH = int(os.getenv("MIN_SENTENCE_LENGTH", 20))
+
+# The end of a sentence - punctuation followed by whitespace (allowing closing quotes and brackets), or a line break:
+SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\n+")
+
+# The kinds of items produced by pipeline_speech:
+TEXT = "text"
+AUDIO = "audio"
+
+
+def wav_header(data_size: int, sample_rate: int = 22050, channels: int = 1, sample_width: int = 2) -> bytes:
+    # The 44-byte header of a PCM WAV file - Neuphonic sends mono, 16-bit audio:
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, channels,
+        sample_rate, byte_rate, channels * sample_width, sample_width * 8, b"data", data_size
+    )
+
+
+# When streaming, the size isn't known up front, so the maximum is used, which players treat as "until the end":
+STREAMING_WAV_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+def parse_wav(data: bytes) -> Tuple[bytes, int, int, int]:
+    # Returns the PCM data, sample rate, channels and sample width of a WAV file, by walking its chunks:
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE": raise ValueError("Not a WAV file.")
+
+    sample_rate, channels, sample_width = 22050, 1, 2
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", data, position)
+        position += 8
+
+        if chunk_id == b"fmt ":
+            channels, sample_rate = struct.unpack_from("<HI", data, position + 2)
+            sample_width = struct.unpack_from("<H", data, position + 14)[0] // 8
+
+        elif chunk_id == b"data":
+            # The size may be a placeholder if the file was streamed, so the data runs to the end at most:
+            return data[position:position + chunk_size], sample_rate, channels, sample_width
+
+        # Chunks are padded to an even size:
+        position += chunk_size + (chunk_size % 2)
+
+    raise ValueError("WAV file has no data chunk.")
+
+
+def stitch_audio(segments: List[bytes], audio_format: str) -> bytes:
+    if not segments: return b""
+
+    # MP3 files are a sequence of independent frames, so they can simply be joined:
+    if audio_format != "wav": return b"".join(segments)
+
+    # WAV files each have a header, so their PCM data is joined under a single new header:
+    parsed = [parse_wav(segment) for segment in segments]
+    _, sample_rate, channels, sample_width = parsed[0]
+    pcm_chunks = [pcm for pcm, *_ in parsed]
+
+    header = wav_header(sum(len(pcm) for pcm in pcm_chunks), sample_rate, channels, sample_width)
+    return b"".join([header, *pcm_chunks])
+
+
+class SentenceSplitter:
+    # Collects streamed text and returns each sentence once it is complete:
+
+    def __init__(self, min_length: int = MIN_SENTENCE_LENGTH):
+        self.min_length = min_length
+        self.buffer = ""
+
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        sentences = []
+        start = 0
+
+        for match in SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if len(sentence) < self.min_length: continue
+
+            sentences.append(sentence)
+            start = match.end()
+
+        self.buffer = self.buffer[start:]
+        return sentences
+
+
+    def flush(self) -> Optional[str]:
+        # Returning whatever is left once the text has ended:
+        sentence, self.buffer = self.buffer.strip(), ""
+        return sentence or None
+
+
+async def pipeline_speech(text_chunks: AsyncIterable[str], synthesize: Callable[[str], Awaitable[bytes]],
+                          concurrency: int = SENTENCE_TTS_CONCURRENCY) -> AsyncGenerator[Tuple[str, object], None]:
+    # Yields (TEXT, chunk) as the text arrives, and (AUDIO, segment) for each sentence in order.
+    # Each sentence is synthesized as soon as it is complete, while later text is still arriving:
+    splitter = SentenceSplitter()
+    semaphore = asyncio.Semaphore(concurrency)
+    pending: Deque[asyncio.Task] = deque()
+
+    async def speak(sentence: str) -> bytes:
+        async with semaphore: return await synthesize(sentence)
+
+    def start_speaking(sentences: List[str]) -> None:
+        for sentence in sentences: pending.append(asyncio.create_task(speak(sentence)))
+
+    chunks = text_chunks.__aiter__()
+    next_chunk: Optional[asyncio.Future] = asyncio.ensure_future(chunks.__anext__())
+
+    try:
+        while next_chunk is not None or pending:
+            # Waking up for whichever comes first - the next piece of text, or the audio that is due next:
+            waiting = [task for task in (next_chunk, pending[0] if pending else None) if task is not None]
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            # Audio is only sent in order, so a finished sentence waits for the ones before it:
+            while pending and pending[0].done():
+                yield AUDIO, pending.popleft().result()
+
+            if next_chunk is not None and next_chunk.done():
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    next_chunk = None
+                    remainder = splitter.flush()
+                    if remainder: start_speaking([remainder])
+                    continue
+
+                yield TEXT, chunk
+                start_speaking(splitter.feed(chunk))
+                next_chunk = asyncio.ensure_future(chunks.__anext__())
+
+    finally:
+        # Stopping any remaining work if the consumer stops early or something fails:
+        for task in [next_chunk, *pending]:
+            if task is not None: task.cancel()
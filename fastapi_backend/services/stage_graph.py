@@ -0,0 +1,53 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from .. import metrics
+
+
+class StageGraph:
+    # Runs async stages as soon as the stages they depend on have finished, so that independent stages overlap.
+    # Each stage receives the results of its dependencies as arguments, in the order they were listed.
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {}
+
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], *dependencies: str) -> "StageGraph":
+        # Stages can only depend on stages added before them, so the graph can't contain cycles:
+        missing = [dependency for dependency in dependencies if dependency not in self.stages]
+        if missing: raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+
+        self.stages[name] = (fn, dependencies)
+        return self
+
+
+    async def run(self) -> Dict[str, Any]:
+        tasks: Dict[str, asyncio.Task] = {}
+        start = time.perf_counter()
+
+        async def run_stage(name: str, fn: Callable[..., Awaitable[Any]], dependencies: Tuple[str, ...]) -> Any:
+            arguments = [await tasks[dependency] for dependency in dependencies]
+
+            # Only the stage's own work is timed, not the time spent waiting for its dependencies:
+            stage_start = time.perf_counter()
+            try: return await fn(*arguments)
+            finally: metrics.observe(f"{self.name}.stages.{name}.seconds", time.perf_counter() - stage_start)
+
+        for name, (fn, dependencies) in self.stages.items():
+            tasks[name] = asyncio.create_task(run_stage(name, fn, dependencies))
+
+        try:
+            await asyncio.gather(*tasks.values())
+
+        except BaseException:
+            # Cancelling the remaining stages if one fails, so that none keep running in the background:
+            for task in tasks.values(): task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        finally:
+            metrics.observe(f"{self.name}.seconds", time.perf_counter() - start)
+
+        return {name: task.result() for name, task in tasks.items()}
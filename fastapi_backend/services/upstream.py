@@ -0,0 +1,162 @@
+import os
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+
+from .. import metrics
+from ..enums import UpstreamStage
+
+T = TypeVar("T")
+
+
+# Connection pool limits, shared by every upstream API (OpenAI and Neuphonic):
+MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 50))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20))
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30))
+
+# Deadlines per stage - connecting should always be quick, but reading depends on the work done upstream:
+STAGE_TIMEOUTS = {
+    UpstreamStage.COMPLETION: httpx.Timeout(connect=5.0, read=60.0, write=20.0, pool=5.0),
+    UpstreamStage.STT: httpx.Timeout(connect=5.0, read=30.0, write=30.0, pool=5.0),
+    UpstreamStage.TTS: httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0),
+    UpstreamStage.NEUPHONIC: httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0),
+}
+
+# Retry policy - only failures that are safe and likely to succeed on another attempt are retried:
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", 4.0))
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Read timeouts are not retried, since the deadline for the stage has already been spent:
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+
+async def _trace(event_name: str, _: dict) -> None:
+    # Counting new connections - requests that don't open one have reused a kept-alive connection:
+    if event_name == "connection.connect_tcp.complete":
+        metrics.increment("upstream.connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        metrics.increment("upstream.tls_handshakes")
+
+
+async def _on_request(request: httpx.Request) -> None:
+    request.extensions["trace"] = _trace
+
+
+# A single async client is shared by the whole process,
+# so that connections to the upstream APIs are pooled and kept alive between requests:
+client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    ),
+    timeout=STAGE_TIMEOUTS[UpstreamStage.COMPLETION],
+    event_hooks={"request": [_on_request]},
+)
+
+# The OpenAI SDK sends its requests through the shared client, with retries handled here instead:
+openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=client, max_retries=0)
+
+_in_flight = 0
+
+
+def pool_stats() -> dict:
+    requests = metrics.get_counter("upstream.requests")
+    opened = metrics.get_counter("upstream.connections_opened")
+
+    return {
+        "in_flight": _in_flight,
+        "max_connections": MAX_CONNECTIONS,
+        "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+        "connection_reuse_ratio": (requests - opened) / requests if requests else None,
+    }
+
+
+metrics.register_gauge("upstream", pool_stats)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, RETRY_EXCEPTIONS): return True
+
+    # The OpenAI SDK wraps the errors raised by the client:
+    if isinstance(error, APIStatusError): return error.status_code in RETRY_STATUS_CODES
+    if isinstance(error, APIConnectionError): return isinstance(error.__cause__, RETRY_EXCEPTIONS)
+
+    return False
+
+
+async def _backoff(stage: UpstreamStage, attempt: int) -> None:
+    # Exponential backoff with full jitter, so that retries from many requests don't arrive together:
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    metrics.increment(f"upstream.{stage.value}.retries")
+    await asyncio.sleep(delay)
+
+
+async def _with_retries(stage: UpstreamStage, attempt_function: Callable[[], Awaitable[T]]) -> T:
+    global _in_flight
+
+    for attempt in range(MAX_RETRIES + 1):
+        metrics.increment("upstream.requests")
+        metrics.increment(f"upstream.{stage.value}.requests")
+        start = time.perf_counter()
+        _in_flight += 1
+
+        try:
+            result = await attempt_function()
+
+        except Exception as e:
+            if isinstance(e, httpx.TimeoutException) or isinstance(e.__cause__, httpx.TimeoutException):
+                metrics.increment(f"upstream.{stage.value}.timeouts")
+
+            if attempt < MAX_RETRIES and _is_retryable(e):
+                await _backoff(stage, attempt)
+                continue
+
+            metrics.increment(f"upstream.{stage.value}.failures")
+            raise
+
+        finally:
+            _in_flight -= 1
+            metrics.observe(f"upstream.{stage.value}.seconds", time.perf_counter() - start)
+
+        # Retrying responses with a retryable status code, after releasing their connection:
+        if isinstance(result, httpx.Response) and result.status_code in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+            await result.aclose()
+            await _backoff(stage, attempt)
+            continue
+
+        return result
+
+
+async def request(stage: UpstreamStage, method: str, url: str, **kwargs) -> httpx.Response:
+    kwargs.setdefault("timeout", STAGE_TIMEOUTS[stage])
+    return await _with_retries(stage, lambda: client.request(method, url, **kwargs))
+
+
+@asynccontextmanager
+async def stream(stage: UpstreamStage, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+    kwargs.setdefault("timeout", STAGE_TIMEOUTS[stage])
+
+    # Only opening the stream is retried - once the body is being read, a retry would repeat content:
+    response = await _with_retries(stage, lambda: client.send(client.build_request(method, url, **kwargs), stream=True))
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+
+async def call(stage: UpstreamStage, function: Callable[..., Awaitable[T]], **kwargs) -> T:
+    # Calling an OpenAI SDK method with the deadline and retry policy of the stage:
+    kwargs.setdefault("timeout", STAGE_TIMEOUTS[stage])
+    return await _with_retries(stage, lambda: function(**kwargs))
+
+
+async def close_client() -> None:
+    await client.aclose()
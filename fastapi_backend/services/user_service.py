@@ -1,15 +1,19 @@
+from sqlalchemy import delete
 from sqlalchemy.exc import IntegrityError
 
 from ..exceptions import UserExistsException
 from ..dependencies import db_dependency, user_dependency
 from ..schemas import CreateUserRequest
-from ..models import User
-from ..security import bcrypt_context
+from ..models import User, ArchivedMessage
+from .. import dynamic_prompts
+from . import context_builder, principal_cache
+from .assistant_service import delete_message_batches
+from .password_hashing import hash_password
 
 
-def create_user(db: db_dependency, user_data: CreateUserRequest) -> User:
-    # Hashing the password:
-    password_hash = bcrypt_context.hash(user_data.password)
+async def create_user(db: db_dependency, user_data: CreateUserRequest) -> User:
+    # Hashing the password - this is slow by design, so it runs in the password hashing workers:
+    password_hash = await hash_password(user_data.password)
 
     # Creating a new user instance with email in lowercase:
     new_user = User(
@@ -22,8 +26,8 @@ def create_user(db: db_dependency, user_data: CreateUserRequest) -> User:
     try: 
         # Returning the new user (will be converted to the response model at the endpoints):
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
 
         return new_user
         
@@ -31,7 +35,18 @@ def create_user(db: db_dependency, user_data: CreateUserRequest) -> User:
         raise UserExistsException
 
 
-def delete_user(db: db_dependency, user: user_dependency) -> None:
-    db.delete(user)
-    db.commit()
-    
+async def delete_user(db: db_dependency, user: user_dependency) -> None:
+    user_id = user.id
+
+    # Deleting the messages in batches first, so that removing the user doesn't become one huge transaction,
+    # along with the archived messages, so that their audio is removed from the blob store too:
+    await delete_message_batches(db, user_id)
+    await delete_message_batches(db, user_id, model=ArchivedMessage)
+
+    # The user's insights are removed by the database, through the ON DELETE CASCADE foreign key:
+    await db.execute(delete(User).where(User.id == user_id))
+    await db.commit()
+    context_builder.invalidate(user_id)
+    # The insights are deleted by the database rather than the ORM, so the compiled prompt is dropped here:
+    dynamic_prompts.invalidate(user_id)
+    principal_cache.invalidate(user_id)
@@ -0,0 +1,47 @@
+import os
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+# The database URL is read on import, so a disposable SQLite database is set up before the app's modules are imported:
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.sqlite')}"
+os.environ.setdefault("HASH_SECRET_KEY", "test-secret")
+os.environ.setdefault("HASH_ALGORITHM", "HS256")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("TOKEN_TTL", "60")
+os.environ.setdefault("NEUPHONIC_API_KEY", "test-key")
+
+from sqlalchemy import text
+
+from fastapi_backend.database import engine, AsyncSessionLocal, async_engine
+from fastapi_backend.models import Base
+from fastapi_backend.services.assistant_service import get_user_messages
+
+
+def test_pages_through_messages_from_the_same_second():
+    Base.metadata.create_all(bind=engine)
+
+    # Storing the timestamps as SQLite's CURRENT_TIMESTAMP default does, without fractions of a second:
+    with engine.begin() as conn:
+        user_id = conn.execute(text("INSERT INTO users (name, email, password) VALUES ('Test', 'test@example.com', '-')")).lastrowid
+        for index in range(25):
+            conn.execute(text("INSERT INTO messages (user_id, type, text, timestamp, feedback) "
+                              "VALUES (:user_id, 'USER', :text, '2024-01-01 12:00:00', 'NEUTRAL')"),
+                         {"user_id": user_id, "text": f"Message {index}"})
+
+    async def read_all_pages() -> list:
+        user, cursor, pages = SimpleNamespace(id=user_id), None, []
+        async with AsyncSessionLocal() as db:
+            while len(pages) <= 25:
+                messages, cursor = await get_user_messages(db, user, limit=10, cursor=cursor)
+                pages.append([message.id for message in messages])
+                if cursor is None: break
+        await async_engine.dispose()
+        return pages
+
+    pages = asyncio.run(read_all_pages())
+
+    # Each page is older than the one before, and every message is returned exactly once:
+    assert [len(page) for page in pages] == [10, 10, 5]
+    ids = [message_id for page in reversed(pages) for message_id in page]
+    assert ids == sorted(ids) and len(set(ids)) == 25
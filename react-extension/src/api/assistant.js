@@ -1,4 +1,4 @@
-import sendRequest from './api';
+import sendRequest, { BASE_URL } from './api';
 
 export function saveVoiceSetting(voice) {
     localStorage.setItem('voiceSetting', voice);
@@ -29,6 +29,24 @@ export async function getMessages() {
     return await sendRequest('/assistant/messages', { method: 'GET' });
 }
 
+// Audio is not included in the message history, so it is downloaded when a message is played:
+export async function getMessageAudio(messageId) {
+    const token = localStorage.getItem('accessToken');
+
+    try {
+        const response = await fetch(`${BASE_URL}/assistant/messages/${messageId}/audio`, {
+            headers: token ? { 'Authorization': `Bearer ${token}` } : {}
+        });
+        if (!response.ok) return null;
+
+        // Creating a URL for the downloaded audio that can be passed to an Audio element:
+        return URL.createObjectURL(await response.blob());
+    } catch (error) {
+        console.error('Error downloading audio:', error);
+        return null;
+    }
+}
+
 export async function completion(text, encodedImage = null, generateAudio = false) {
     const formData = new FormData();
 
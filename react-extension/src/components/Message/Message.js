@@ -6,15 +6,28 @@ import { toast } from 'react-toastify';
 import ThumbUpOutlinedIcon from '@mui/icons-material/ThumbUpOutlined';
 import ThumbDownOutlinedIcon from '@mui/icons-material/ThumbDownOutlined';
 import { useAudioPlayer } from '../../context/AudioPlayerContext';
-import { updateMessageFeedback } from '../../api/assistant';
+import { updateMessageFeedback, getMessageAudio } from '../../api/assistant';
 
 function Message({ message }) {
     const isUser = message.type === 'user';
-    const { isPlaying, toggleAudio } = useAudioPlayer(message.encoded_audio, message.id);
+    const [audio, setAudio] = useState(message.encoded_audio);
+    const { isPlaying, toggleAudio } = useAudioPlayer(audio, message.id);
 
     const [feedback, setFeedback] = useState(message.feedback);
 
-    const handleClick = () => message.encoded_audio && toggleAudio();
+    const hasAudio = Boolean(message.encoded_audio || message.audio_url);
+
+    const handleClick = async () => {
+        if (!hasAudio) return;
+        if (audio) return toggleAudio();
+
+        // Downloading the audio the first time the message is played:
+        const downloadedAudio = await getMessageAudio(message.id);
+        if (downloadedAudio) {
+            setAudio(downloadedAudio);
+            toggleAudio(downloadedAudio);
+        }
+    };
 
     const handleFeedback = async (feedback) => {
         await updateMessageFeedback(message.id, feedback);
@@ -44,17 +57,17 @@ function Message({ message }) {
                 }}
             >
                 <Box
-                    tabIndex={message.encoded_audio ? 0 : -1}
-                    role={message.encoded_audio ? 'button' : 'group'}
+                    tabIndex={hasAudio ? 0 : -1}
+                    role={hasAudio ? 'button' : 'group'}
                     aria-label={
-                        message.encoded_audio
+                        hasAudio
                             ? isPlaying
                                 ? 'Stop playback'
                                 : 'Play audio message'
                             : 'Message'
                     }
                     sx={{
-                        cursor: message.encoded_audio ? 'pointer' : 'default',
+                        cursor: hasAudio ? 'pointer' : 'default',
                         outline: 'none',
                         marginBottom: '4px',
                     }}
@@ -109,7 +122,7 @@ function Message({ message }) {
                     {/* Spacer to push the audio icon to the right */}
                     <Box sx={{ flexGrow: 1 }} />
 
-                    {message.encoded_audio && (
+                    {hasAudio && (
                         <IconButton
                             aria-label={isPlaying ? 'Stop audio' : 'Play audio'}
                             onClick={handleClick}
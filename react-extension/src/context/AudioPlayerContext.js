@@ -13,7 +13,9 @@ export const AudioPlayerProvider = ({ children }) => {
       audioInstance.pause();
     }
 
-    const newAudioInstance = new Audio(`data:audio/wav;base64,${encodedAudio}`);
+    // Downloaded audio is already a URL, while audio from a completion is base64-encoded:
+    const source = encodedAudio.startsWith('blob:') ? encodedAudio : `data:audio/wav;base64,${encodedAudio}`;
+    const newAudioInstance = new Audio(source);
 
     // Getting the saved voice speed (default 1 if not set):
     const voiceSpeed = getVoiceSpeed();
@@ -65,9 +67,9 @@ export const useAudioPlayer = (encodedAudio, messageId) => {
 
   const isMessagePlaying = isPlaying && playingMessageId === messageId;
 
-  const handleToggleAudio = () => {
-    if (encodedAudio && messageId !== undefined) {
-      toggleAudio(encodedAudio, messageId);
+  const handleToggleAudio = (audio = encodedAudio) => {
+    if (audio && messageId !== undefined) {
+      toggleAudio(audio, messageId);
     }
   };
 